@@ -0,0 +1,96 @@
+from crf_writer import CreditReportWriter, CreditRecord, Account
+from crf_reader import CreditReportReader
+from bench_crf import make_records
+import argparse
+import gc
+import hashlib
+import io
+import struct
+import time
+
+# Compares the original per-field struct.pack/unpack + BytesIO record loop against the
+# precompiled codec (encode_record / decode_record). Encryption is left out so only the codec is timed.
+
+# original implementation, kept here as the "before" measurement
+def baseline_write_string(f, s: str):
+    encoded = s.encode("utf-8")
+    f.write(struct.pack("<I", len(encoded)))
+    f.write(encoded)
+
+def baseline_write_record(f, record: CreditRecord, hashed_sin: str):
+    baseline_write_string(f, hashed_sin)
+    baseline_write_string(f, record.name)
+    baseline_write_string(f, record.address)
+    f.write(struct.pack("<I", record.credit_score))
+    f.write(struct.pack("<I", record.account_count))
+    f.write(struct.pack("<I", record.major_flags))
+    for acc in record.accounts:
+        baseline_write_string(f, acc.name)
+        f.write(struct.pack("<i", acc.balance))
+
+def baseline_read_string(f):
+    length = struct.unpack("<I", f.read(4))[0]
+    return f.read(length).decode("utf-8")
+
+def baseline_read_record(f):
+    sin = baseline_read_string(f)
+    name = baseline_read_string(f)
+    address = baseline_read_string(f)
+    credit_score = struct.unpack("<I", f.read(4))[0]
+    account_count = struct.unpack("<I", f.read(4))[0]
+    major_flags = struct.unpack("<I", f.read(4))[0]
+    accounts = []
+    for _ in range(account_count):
+        acc_name = baseline_read_string(f)
+        balance = struct.unpack("<i", f.read(4))[0]
+        accounts.append(Account(acc_name, balance))
+    return CreditRecord(sin, name, address, credit_score, account_count, major_flags, accounts)
+
+def timed(label: str, count: int, fn):
+    gc.collect()
+    gc.disable() # keeps cyclic GC passes over millions of live objects out of the numbers
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    gc.enable()
+    print(f"  {label:<28} {elapsed:8.2f} s {count / elapsed:12,.0f} records/s")
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="Record codec benchmark")
+    parser.add_argument("--records", type=int, default=1_000_000)
+    args = parser.parse_args()
+    count = args.records
+
+    print(f"Generating {count:,} records")
+    records = make_records(count)
+    hashes = [hashlib.sha256(r.sin.encode()).hexdigest() for r in records] # hashing is the same either way
+
+    print("Encode:")
+    def encode_baseline():
+        f = io.BytesIO()
+        for record, hashed_sin in zip(records, hashes):
+            baseline_write_record(f, record, hashed_sin)
+        return f.getvalue()
+    def encode_codec():
+        return b"".join(CreditReportWriter.encode_record(record, hashed_sin) for record, hashed_sin in zip(records, hashes))
+    data = timed("struct.pack per field", count, encode_baseline)
+    assert timed("precompiled codec", count, encode_codec) == data
+
+    print("Decode:")
+    def decode_baseline():
+        f = io.BytesIO(data)
+        return [baseline_read_record(f) for _ in range(count)]
+    def decode_codec():
+        position = 0
+        out = []
+        for _ in range(count):
+            record, position = CreditReportReader.decode_record(data, position)
+            out.append(record)
+        return out
+    before = [r.sin for r in timed("struct.unpack + BytesIO", count, decode_baseline)]
+    after = [r.sin for r in timed("unpack_from over buffer", count, decode_codec)]
+    assert before == after
+
+if __name__ == "__main__":
+    main()
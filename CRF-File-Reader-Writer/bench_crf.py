@@ -0,0 +1,173 @@
+from crf_writer import CreditReportWriter, CreditRecord, Account, VERSION
+from crf_reader import CreditReportReader
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import string
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# End-to-end benchmarks for write_file, read_file, iter_records, scan, read_metadata and the lookup paths
+# over synthetic files of 1e3..1e6 records. Throughput runs without tracemalloc (it slows Python down
+# several times); peak memory is measured in a second run of the same operation. Results go to JSON, and
+# --compare prints the ratio against an earlier results file.
+
+ACCOUNT_NAMES = ["Chequing", "Savings", "Credit Card", "Auto Loan", "Line of Credit", "Investment"]
+LOOKUP_SAMPLES = 200 # lookups timed per size for the latency percentiles
+METADATA_SAMPLES = 200
+
+def make_records(count: int, seed: int = 42, max_accounts: int = 4, name_length: int = 12, address_length: int = 32):
+    # deterministic for a given seed, so runs and versions are comparable; SINs are the record number
+    rng = random.Random(seed)
+    letters = string.ascii_letters + " "
+    records = []
+    for i in range(count):
+        account_count = rng.randint(0, max_accounts)
+        records.append(CreditRecord(
+            sin=f"{i:09d}",
+            name="".join(rng.choices(letters, k=name_length)),
+            address="".join(rng.choices(letters, k=address_length)),
+            credit_score=rng.randint(300, 900),
+            account_count=account_count,
+            major_flags=rng.randint(0, 7),
+            accounts=[Account(rng.choice(ACCOUNT_NAMES), rng.randint(-100000, 100000)) for _ in range(account_count)]
+        ))
+    return records
+
+def percentiles(samples: list) -> dict:
+    samples = sorted(samples)
+    def at(fraction):
+        return samples[min(len(samples) - 1, int(fraction * len(samples)))] * 1000
+    return {"p50_ms": at(0.50), "p90_ms": at(0.90), "p99_ms": at(0.99), "max_ms": samples[-1] * 1000,
+            "mean_ms": statistics.fmean(samples) * 1000}
+
+def peak_memory(fn) -> int:
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def throughput(label: str, count: int, size: int, fn, memory: bool) -> dict:
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    result = {"operation": label, "seconds": elapsed, "records_per_s": count / elapsed, "mb_per_s": size / elapsed / 1e6}
+    if memory:
+        result["peak_bytes"] = peak_memory(fn)
+    return result
+
+def latency(label: str, samples: int, fn) -> dict:
+    timings = []
+    for i in range(samples):
+        start = time.perf_counter()
+        fn(i)
+        timings.append(time.perf_counter() - start)
+    return {"operation": label, "samples": samples, **percentiles(timings)}
+
+def bench_size(count: int, args, directory: str) -> list:
+    print(f"{count:,} records")
+    records = make_records(count, args.seed, args.max_accounts, args.name_length, args.address_length)
+    key = CreditReportWriter.generate_key()
+    filename = os.path.join(directory, f"bench_{count}.crf")
+    options = {"compression": args.compression, "workers": args.workers, "bloom_filter": args.bloom_filter}
+
+    results = [throughput("write_file", count, 0, lambda: CreditReportWriter.write_file(filename, records, key, **options), args.memory)]
+    size = os.path.getsize(filename)
+    results[0]["mb_per_s"] = size / results[0]["seconds"] / 1e6
+    results[0]["file_bytes"] = size
+    del records
+
+    def iterate():
+        for _ in CreditReportReader.iter_records(filename, key):
+            pass
+    def scan():
+        for _ in CreditReportReader.scan(filename, key, ["credit_score"]):
+            pass
+    results.append(throughput("read_file", count, size, lambda: CreditReportReader.read_file(filename, key), args.memory))
+    results.append(throughput("iter_records", count, size, iterate, args.memory))
+    results.append(throughput("scan(credit_score)", count, size, scan, args.memory))
+
+    rng = random.Random(args.seed)
+    sins = [f"{rng.randrange(count):09d}" for _ in range(LOOKUP_SAMPLES)]
+    results.append(latency("read_metadata", METADATA_SAMPLES, lambda i: CreditReportReader.read_metadata(filename, key)))
+    results.append(latency("find_by_sin", LOOKUP_SAMPLES, lambda i: CreditReportReader.find_by_sin(filename, sins[i], key)))
+    results.append(latency("find_by_sins(100)", 20, lambda i: CreditReportReader.find_by_sins(filename, sins[:100], key)))
+    results.append(latency("might_contain", LOOKUP_SAMPLES, lambda i: CreditReportReader.might_contain(filename, sins[i], key)))
+
+    for result in results:
+        result["records"] = count
+        line = f"  {result['operation']:<20}"
+        if "records_per_s" in result:
+            line += f" {result['seconds']:8.2f} s {result['records_per_s']:12,.0f} records/s"
+        else:
+            line += f" p50 {result['p50_ms']:8.3f} ms  p99 {result['p99_ms']:8.3f} ms"
+        if "peak_bytes" in result:
+            line += f"  peak {result['peak_bytes'] / 1e6:8.1f} MB"
+        print(line)
+    os.remove(filename)
+    return results
+
+def compare(results: list, baseline_file: str):
+    with open(baseline_file) as f:
+        baseline = {(r["records"], r["operation"]): r for r in json.load(f)["results"]}
+    print(f"Compared with {baseline_file} (>1 is faster / smaller now):")
+    for result in results:
+        before = baseline.get((result["records"], result["operation"]))
+        if before is None:
+            continue
+        if "records_per_s" in result:
+            line = f"  {result['records']:>9,} {result['operation']:<20} speed x{result['records_per_s'] / before['records_per_s']:.2f}"
+        else:
+            line = f"  {result['records']:>9,} {result['operation']:<20} p50 x{before['p50_ms'] / result['p50_ms']:.2f}"
+        if "peak_bytes" in result and "peak_bytes" in before:
+            line += f"  memory x{before['peak_bytes'] / result['peak_bytes']:.2f}"
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description="CRF reader/writer benchmark suite")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000, 1_000_000])
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--max-accounts", type=int, default=4)
+    parser.add_argument("--name-length", type=int, default=12)
+    parser.add_argument("--address-length", type=int, default=32)
+    parser.add_argument("--compression", choices=["zlib", "lzma", "zstd"], default=None)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--bloom-filter", action="store_true", help="write files with a Bloom filter for might_contain")
+    parser.add_argument("--no-memory", dest="memory", action="store_false", help="skip the tracemalloc runs")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="crf_bench_")
+    try:
+        results = []
+        for count in args.sizes:
+            results += bench_size(count, args, directory)
+    finally:
+        shutil.rmtree(directory)
+
+    report = {
+        "format_version": VERSION,
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "parameters": {name: value for name, value in vars(args).items() if name not in ("output", "compare")},
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+from typing import Dict, Iterable, List, Optional
+
+import asyncio
+from collections import deque
+from concurrent.futures import Executor, ThreadPoolExecutor
+from functools import partial
+
+from crf_reader import CreditReportReader, CreditRecord, FileMetaData, Magic_Number
+from crf_writer import CreditReportStreamWriter
+
+# asyncio front end for the reader and writer. File I/O, Fernet and record parsing never run on the event
+# loop: reads go to the given executor (the loop's default thread pool when None, or a ProcessPoolExecutor
+# to decrypt and parse in parallel), and a streaming writer's calls run in order on a thread of its own.
+# Both sides keep a bounded number of jobs in flight, so a slow consumer or disk holds back the producer
+# instead of piling up buffers, and cancelling the awaiting task cancels the jobs that have not started.
+
+PREFETCH = 2        # segments decoded ahead of the consumer in iter_records
+WRITE_BATCH = 1024  # records handed to the stream writer per job
+MAX_PENDING = 2     # write jobs in flight before append() waits
+
+class AsyncCreditReportReader:
+    @staticmethod
+    async def read_file(filename: str, encryption_key: bytes, executor: Executor = None) -> List[CreditRecord]:
+        return await asyncio.get_running_loop().run_in_executor(executor, CreditReportReader.read_file, filename, encryption_key)
+
+    @staticmethod
+    async def read_metadata(filename: str, encryption_key: bytes, executor: Executor = None) -> FileMetaData:
+        return await asyncio.get_running_loop().run_in_executor(executor, CreditReportReader.read_metadata, filename, encryption_key)
+
+    @staticmethod
+    async def find_by_sin(filename: str, sin: str, encryption_key: bytes, executor: Executor = None) -> Optional[CreditRecord]:
+        return await asyncio.get_running_loop().run_in_executor(executor, CreditReportReader.find_by_sin, filename, sin, encryption_key)
+
+    @staticmethod
+    async def find_by_sins(filename: str, sins: Iterable[str], encryption_key: bytes,
+                           executor: Executor = None) -> Dict[str, CreditRecord]:
+        return await asyncio.get_running_loop().run_in_executor(
+            executor, CreditReportReader.find_by_sins, filename, list(sins), encryption_key)
+
+    @staticmethod
+    async def iter_records(filename: str, encryption_key: bytes, batch_size: int = None, executor: Executor = None,
+                           prefetch: int = PREFETCH):
+        # async counterpart of CreditReportReader.iter_records
+        segments = AsyncCreditReportReader._iter_segments(filename, encryption_key, executor, prefetch)
+        batch = []
+        try:
+            async for records in segments:
+                if batch_size is None:
+                    for record in records:
+                        yield record
+                    continue
+                for record in records: # hand records out in lists of batch_size
+                    batch.append(record)
+                    if len(batch) == batch_size:
+                        yield batch
+                        batch = []
+            if batch:
+                yield batch
+        finally:
+            await segments.aclose() # cancels the read-ahead right away when the consumer stops early
+
+    @staticmethod
+    async def _iter_segments(filename: str, encryption_key: bytes, executor: Executor, prefetch: int):
+        # yields the records of one v3 segment at a time; each segment is decrypted and decoded as one
+        # executor job, with at most `prefetch` of them running or waiting for the consumer
+        loop = asyncio.get_running_loop()
+        plan = await loop.run_in_executor(executor, AsyncCreditReportReader._plan, filename, encryption_key)
+        if plan is None: # v1/v2 files are a single token, read in one job
+            yield await loop.run_in_executor(executor, CreditReportReader.read_file, filename, encryption_key)
+            return
+
+        flags, dictionary, blocks = plan
+        blocks = iter(blocks)
+        pending = deque()
+        try:
+            while True:
+                while len(pending) < prefetch:
+                    block = next(blocks, None)
+                    if block is None:
+                        break
+                    pending.append(loop.run_in_executor(executor, AsyncCreditReportReader._read_segment,
+                                                        filename, encryption_key, flags, dictionary, *block))
+                if not pending:
+                    break
+                yield await pending.popleft()
+        finally:
+            for future in pending: # consumer stopped or was cancelled, drop the read-ahead
+                future.cancel()
+
+    @staticmethod
+    def _plan(filename: str, encryption_key: bytes) -> Optional[tuple]:
+        # runs in the executor: header, superseded offsets and dictionary are read once per file, so each
+        # segment job only has to decrypt and decode. Returns None for v1/v2 files
+        with open(filename, "rb") as file:
+            if file.read(len(Magic_Number)) != Magic_Number:
+                return None
+            fernet = CreditReportReader._fernet(encryption_key)
+            header = CreditReportReader._read_header(file, encryption_key)
+            dropped = CreditReportReader._superseded(file, header, fernet)
+            dictionary = CreditReportReader._read_dictionary(file, fernet, header)
+        stored = sum(entry[2] for entry in header.segments)
+        if stored - sum(len(offsets) for offsets in dropped.values()) != header.record_count:
+            raise ValueError("Record count mismatch.")
+        blocks = [(segment, dropped.get(number)) for number, segment in enumerate(header.segments)]
+        return header.flags, dictionary, blocks
+
+    @staticmethod
+    def _read_segment(filename: str, encryption_key: bytes, flags: int, dictionary: Optional[List[str]], segment: tuple,
+                      dropped: Optional[set]) -> List[CreditRecord]:
+        # runs in the executor, possibly in another process, so it takes plain values only
+        with open(filename, "rb") as file:
+            token = CreditReportReader._read_token(file, segment)
+        buffer = CreditReportReader._open_block(CreditReportReader._fernet(encryption_key), token, flags)
+        records = []
+        position = 0
+        for _ in range(segment[2]):
+            start = position
+            record, position = CreditReportReader.decode_record(buffer, position, dictionary)
+            if not (dropped and start in dropped): # superseded by a newer delta
+                records.append(record)
+        return records
+
+class AsyncCreditReportWriter:
+    @staticmethod
+    async def open(filename: str, encryption_key: bytes, batch_size: int = WRITE_BATCH, max_pending: int = MAX_PENDING,
+                   **options) -> "AsyncCreditReportStreamWriter":
+        # options go to CreditReportWriter.open (segment_size, workers, compression, ...)
+        writer = AsyncCreditReportStreamWriter(batch_size, max_pending)
+        try:
+            writer._writer = await writer._call(partial(CreditReportStreamWriter, filename, encryption_key, **options))
+        except BaseException:
+            writer._executor.shutdown(wait=False)
+            raise
+        return writer
+
+    @staticmethod
+    async def write_file(filename: str, records, encryption_key: bytes, **options):
+        # records may be a regular or an async iterable
+        async with await AsyncCreditReportWriter.open(filename, encryption_key, **options) as writer:
+            await writer.extend(records)
+
+class AsyncCreditReportStreamWriter:
+    # wraps a CreditReportStreamWriter; every call on it runs on one dedicated thread, so jobs stay in
+    # order and abort() only runs once the job in progress is done with the file
+    def __init__(self, batch_size: int = WRITE_BATCH, max_pending: int = MAX_PENDING):
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.closed = False
+        self._writer: Optional[CreditReportStreamWriter] = None
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._batch = []
+        self._pending = deque()
+
+    @property
+    def record_count(self) -> int:
+        return self._writer.record_count if self._writer is not None else 0
+
+    async def _call(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    async def append(self, record: CreditRecord, hashed_sin: str = None):
+        if self.closed:
+            raise ValueError("Writer is closed.")
+        self._batch.append((record, hashed_sin))
+        if len(self._batch) >= self.batch_size:
+            await self._submit()
+
+    async def extend(self, records):
+        if hasattr(records, "__aiter__"):
+            async for record in records:
+                await self.append(record)
+        else:
+            for record in records:
+                await self.append(record)
+
+    async def _submit(self):
+        batch, self._batch = self._batch, []
+        self._pending.append(asyncio.ensure_future(self._call(self._write_batch, batch)))
+        while len(self._pending) > self.max_pending: # backpressure: wait for the writer thread to catch up
+            await self._pending.popleft()
+
+    def _write_batch(self, batch: List[tuple]):
+        for record, hashed_sin in batch:
+            self._writer.append(record, hashed_sin)
+
+    async def flush(self):
+        if self._batch:
+            await self._submit()
+        while self._pending:
+            await self._pending.popleft()
+        await self._call(self._writer.flush)
+
+    async def close(self):
+        if self.closed:
+            return
+        try:
+            if self._batch:
+                await self._submit()
+            while self._pending:
+                await self._pending.popleft()
+        except BaseException: # a batch failed, e.g. a record append() rejected: drop the temporary file
+            await self.abort()
+            raise
+        try:
+            await self._call(self._writer.close)
+        finally:
+            self.closed = True
+            self._executor.shutdown(wait=False)
+
+    async def abort(self):
+        # drops jobs that have not started; the writer's own abort runs after the one in progress
+        if self.closed:
+            return
+        self.closed = True
+        for future in self._pending:
+            future.cancel()
+        self._pending.clear()
+        self._batch = []
+        try:
+            await asyncio.shield(self._call(self._writer.abort))
+        finally:
+            self._executor.shutdown(wait=False)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            await self.close()
+        else: # includes asyncio.CancelledError
+            await self.abort()
@@ -0,0 +1,90 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Set
+
+import hashlib
+import os
+import threading
+
+# Opt-in, process-local cache for the reader: authenticated headers, decrypted segments and index blocks,
+# parsed SIN index buckets and account name dictionaries of hot files. Enable it with
+#     CreditReportReader.cache = CRFCache(max_bytes=256 * 1024 * 1024)
+# Entries are keyed by the file's path, size, mtime and inode plus a fingerprint of the key it was opened
+# with, so a different key never shares another caller's plaintext, and the first access after a file
+# changes drops everything cached for its old version. Least recently used entries are evicted once the
+# total size passes max_bytes. Cached plaintext stays in this process's memory until evicted or cleared.
+
+MAX_BYTES = 256 * 1024 * 1024
+
+@dataclass
+class CacheStats:
+    hits: int
+    misses: int
+    evictions: int
+    invalidations: int # entries dropped because their file changed
+    entries: int
+    bytes: int
+    max_bytes: int
+
+class CRFCache:
+    def __init__(self, max_bytes: int = MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict() # (file key, item) → (value, size), least recently used first
+        self._files: Dict[str, tuple] = {} # path → (size, mtime, inode) of the version being cached
+        self._keys: Dict[str, Set[tuple]] = {} # path → its entry keys, for invalidation
+        self._bytes = 0
+        self._lock = threading.Lock() # readers may share one cache across threads
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def file_key(self, file, encryption_key) -> tuple:
+        # identifies the open file's current version and the key(s) it is read with
+        path = os.path.realpath(file.name)
+        stat = os.fstat(file.fileno())
+        version = (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+        keys = encryption_key if isinstance(encryption_key, (list, tuple)) else [encryption_key]
+        fingerprint = hashlib.sha256(b"\0".join(key.encode() if isinstance(key, str) else key for key in keys)).digest()
+        with self._lock:
+            if self._files.get(path, version) != version: # the file changed, its old entries can never be hit again
+                for key in self._keys.pop(path, ()):
+                    self._bytes -= self._entries.pop(key)[1]
+                    self.invalidations += 1
+            self._files[path] = version
+        return (path, *version, fingerprint)
+
+    def get(self, key: tuple):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: tuple, value, size: int):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self._keys.setdefault(key[0][0], set()).add(key)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                old_key, (_, old_size) = self._entries.popitem(last=False)
+                self._keys[old_key[0][0]].discard(old_key)
+                self._bytes -= old_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._files.clear()
+            self._keys.clear()
+            self._bytes = 0
+
+    @property
+    def stats(self) -> CacheStats:
+        with self._lock:
+            return CacheStats(self.hits, self.misses, self.evictions, self.invalidations, len(self._entries),
+                              self._bytes, self.max_bytes)
@@ -0,0 +1,235 @@
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional
+
+from cryptography.fernet import Fernet
+import hashlib
+import io
+import os
+import struct
+
+from crf_reader import CreditReportReader, CreditRecord, Magic_Number
+from crf_writer import BUCKET_ENTRY, INDEX_BUCKET_SIZE, VERSION, CreditReportWriter
+
+# A dataset is a directory of v3 .crf shards plus an encrypted manifest that maps every hashed SIN to
+# (shard, segment, offset), so a lookup decrypts one manifest bucket and one shard segment instead of
+# probing every file. The manifest reuses the v3 container: hash-bucketed Fernet tokens like the SIN
+# index, a SHRD header table listing each shard's name, size, mtime and record count, and the same
+# authenticated header. A SIN stored in several shards resolves to the shard added last.
+
+MANIFEST_NAME = "manifest.crfm"
+MANIFEST_ENTRY = struct.Struct("<III")  # shard number, segment number, offset inside the segment
+SHARD_ENTRY = struct.Struct("<QqI")     # shard file size, mtime in ns, record count
+U32 = struct.Struct("<I")
+
+@dataclass
+class ShardInfo: # per-shard metadata kept in the manifest, also used to spot shards changed since the last refresh
+    name: str
+    size: int
+    mtime_ns: int
+    record_count: int
+
+class CreditReportDataset:
+    def __init__(self, directory: str, encryption_key: bytes):
+        # one key (or a list of keys during a rotation window, newest first) for the manifest and every shard
+        self.directory = directory
+        self._encryption_key = encryption_key
+        self._fernet = CreditReportReader._fernet(encryption_key)
+        self.manifest = os.path.join(directory, MANIFEST_NAME)
+
+    @property
+    def shards(self) -> List[ShardInfo]:
+        if not os.path.exists(self.manifest):
+            return []
+        with open(self.manifest, "rb") as file:
+            return self._read_shards(CreditReportReader._read_header(file, self._encryption_key))
+
+    @property
+    def record_count(self) -> int:
+        return sum(shard.record_count for shard in self.shards)
+
+    def write_shard(self, name: str, records: Iterable[CreditRecord], **options):
+        # writes a new shard (options go to CreditReportWriter.write_file) and adds it to the manifest
+        CreditReportWriter.write_file(os.path.join(self.directory, name), records, self._write_key(), **options)
+        self.refresh()
+
+    def refresh(self):
+        # brings the manifest in line with the directory: only new, changed and removed shards are read,
+        # entries of untouched shards are carried over from the old manifest
+        shards, entries = self._load_manifest()
+        on_disk = {name: os.stat(os.path.join(self.directory, name))
+                   for name in sorted(os.listdir(self.directory)) if name.endswith(".crf")}
+
+        kept: List[ShardInfo] = []
+        numbers: Dict[int, int] = {} # old shard number → new shard number, for shards whose entries still hold
+        reread: List[int] = []       # new shard numbers whose index has to be read
+        for number, shard in enumerate(shards):
+            stat = on_disk.pop(shard.name, None)
+            if stat is None: # removed
+                continue
+            if (stat.st_size, stat.st_mtime_ns) == (shard.size, shard.mtime_ns):
+                numbers[number] = len(kept)
+            else: # appended to or rewritten, keeps its place in the order
+                reread.append(len(kept))
+            kept.append(shard)
+        for name in on_disk: # new shards go last, so they win over older copies of the same SIN
+            reread.append(len(kept))
+            kept.append(ShardInfo(name, 0, 0, 0))
+
+        orphans = set() # SINs whose shard is gone or changed; an older shard may still hold them
+        live = {}
+        for sin_hash, (number, segment, offset) in entries.items():
+            if number in numbers:
+                live[sin_hash] = (numbers[number], segment, offset)
+            else:
+                orphans.add(sin_hash)
+
+        for number in reread:
+            path = os.path.join(self.directory, kept[number].name)
+            with open(path, "rb") as file:
+                if file.read(len(Magic_Number)) != Magic_Number:
+                    raise ValueError(f"Dataset shards must be v3 files: {kept[number].name}")
+                header = CreditReportReader._read_header(file, self._encryption_key)
+                for sin_hash, (segment, offset) in CreditReportReader._live_index(file, header, self._fernet).items():
+                    current = live.get(sin_hash)
+                    if current is None or current[0] < number:
+                        live[sin_hash] = (number, segment, offset)
+            stat = os.stat(path)
+            kept[number] = ShardInfo(kept[number].name, stat.st_size, stat.st_mtime_ns, header.record_count)
+
+        orphans -= live.keys()
+        for number in reversed(range(len(kept))): # newest first, like the lookup order
+            if not orphans:
+                break
+            if number in reread:
+                continue
+            with open(os.path.join(self.directory, kept[number].name), "rb") as file:
+                file.read(len(Magic_Number))
+                header = CreditReportReader._read_header(file, self._encryption_key)
+                for sin_hash, (segment, offset) in CreditReportReader._locate(file, header, self._fernet, orphans).items():
+                    live[sin_hash] = (number, segment, offset)
+            orphans -= live.keys()
+
+        self._write_manifest(kept, live)
+
+    def find_by_sin(self, sin: str) -> Optional[CreditRecord]:
+        return self.find_by_sins([sin]).get(sin)
+
+    def find_by_sins(self, sins: Iterable[str]) -> Dict[str, CreditRecord]:
+        wanted = {hashlib.sha256(sin.encode()).hexdigest(): sin for sin in sins}
+        if not os.path.exists(self.manifest):
+            return {}
+        with open(self.manifest, "rb") as file:
+            file.read(len(Magic_Number))
+            header = CreditReportReader._read_header(file, self._encryption_key)
+            shards = self._read_shards(header)
+            by_bucket: Dict[int, List[str]] = {} # each manifest bucket is decrypted once
+            for sin_hash in wanted:
+                by_bucket.setdefault(CreditReportReader._index_bucket(sin_hash, len(header.buckets)), []).append(sin_hash)
+            by_shard: Dict[int, Dict[str, tuple]] = {}
+            for bucket, group in by_bucket.items():
+                entries = self._read_manifest_bucket(file, header, header.buckets[bucket])
+                for sin_hash in group:
+                    if sin_hash in entries:
+                        number, segment, offset = entries[sin_hash]
+                        by_shard.setdefault(number, {})[sin_hash] = (segment, offset)
+
+        found = {}
+        for number, located in by_shard.items():
+            shard = shards[number]
+            path = os.path.join(self.directory, shard.name)
+            stat = os.stat(path)
+            if (stat.st_size, stat.st_mtime_ns) != (shard.size, shard.mtime_ns): # offsets may no longer hold
+                raise ValueError(f"Shard {shard.name} changed since the manifest was written; call refresh().")
+            with open(path, "rb") as file:
+                file.read(len(Magic_Number))
+                header = CreditReportReader._read_header(file, self._encryption_key)
+                for sin_hash, record in CreditReportReader._read_located(file, header, self._fernet, located).items():
+                    found[wanted[sin_hash]] = record
+        return found
+
+    def iter_records(self):
+        # every record of every shard, shard by shard in manifest order
+        for shard in self.shards:
+            yield from CreditReportReader.iter_records(os.path.join(self.directory, shard.name), self._encryption_key)
+
+    def scan(self, columns: Iterable[str] = None, where=None):
+        columns = None if columns is None else tuple(columns)
+        for shard in self.shards:
+            yield from CreditReportReader.scan(os.path.join(self.directory, shard.name), self._encryption_key, columns, where)
+
+    def _write_key(self) -> bytes:
+        return CreditReportReader._keys(self._encryption_key)[0] # new data is always written with the newest key
+
+    def _load_manifest(self) -> tuple:
+        if not os.path.exists(self.manifest):
+            return [], {}
+        entries = {}
+        with open(self.manifest, "rb") as file:
+            file.read(len(Magic_Number))
+            header = CreditReportReader._read_header(file, self._encryption_key)
+            for bucket in header.buckets:
+                entries.update(self._read_manifest_bucket(file, header, bucket))
+        return self._read_shards(header), entries
+
+    def _read_manifest_bucket(self, file, header, bucket: tuple) -> Dict[str, tuple]:
+        buffer = CreditReportReader._read_block(file, self._fernet, header, bucket)
+        entries = {}
+        position = 4
+        for _ in range(U32.unpack_from(buffer, 0)[0]):
+            length = U32.unpack_from(buffer, position)[0]
+            position += 4
+            sin_hash = buffer[position:position + length].decode("utf-8")
+            position += length
+            entries[sin_hash] = MANIFEST_ENTRY.unpack_from(buffer, position)
+            position += MANIFEST_ENTRY.size
+        return entries
+
+    @staticmethod
+    def _read_shards(header) -> List[ShardInfo]:
+        table = header.sections.get(b"SHRD", b"")
+        shards = []
+        position = 0
+        while position < len(table):
+            length = U32.unpack_from(table, position)[0]
+            name = table[position + 4:position + 4 + length].decode("utf-8")
+            position += 4 + length
+            shards.append(ShardInfo(name, *SHARD_ENTRY.unpack_from(table, position)))
+            position += SHARD_ENTRY.size
+        return shards
+
+    def _write_manifest(self, shards: List[ShardInfo], entries: Dict[str, tuple]):
+        encryption_key = self._write_key()
+        fernet = Fernet(encryption_key)
+        bucket_count = max(1, -(-len(entries) // INDEX_BUCKET_SIZE))
+        partitions = [{} for _ in range(bucket_count)]
+        for sin_hash, location in entries.items():
+            partitions[CreditReportReader._index_bucket(sin_hash, bucket_count)][sin_hash] = location
+
+        shard_table = io.BytesIO()
+        for shard in shards:
+            CreditReportWriter.write_string(shard_table, shard.name)
+            shard_table.write(SHARD_ENTRY.pack(shard.size, shard.mtime_ns, shard.record_count))
+
+        temp_file = self.manifest + ".tmp" # same directory, so os.replace below is atomic
+        try:
+            with open(temp_file, "wb") as f:
+                f.write(Magic_Number)
+                f.write(struct.pack("<H", VERSION))
+                buckets = []
+                for partition in partitions:
+                    payload = io.BytesIO()
+                    payload.write(U32.pack(len(partition)))
+                    for sin_hash, location in partition.items():
+                        CreditReportWriter.write_string(payload, sin_hash)
+                        payload.write(MANIFEST_ENTRY.pack(*location))
+                    buckets.append(CreditReportWriter._write_block(f, fernet, payload.getvalue()))
+                # no segments and a record count of 0: the manifest holds locations, not records
+                CreditReportWriter._write_header(f, encryption_key, 0, 0, [], {
+                    b"IDXB": b"".join(BUCKET_ENTRY.pack(*entry) for entry in buckets),
+                    b"SHRD": shard_table.getvalue(),
+                })
+            os.replace(temp_file, self.manifest)
+        except BaseException:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+            raise
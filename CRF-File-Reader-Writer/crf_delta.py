@@ -0,0 +1,110 @@
+from typing import Dict, Iterable
+
+import hashlib
+import os
+
+from cryptography.fernet import Fernet
+
+from crf_reader import CreditReportReader, Magic_Number
+from crf_writer import (BUCKET_ENTRY, COMPRESSION_CODECS, DELTA_ENTRY, FLAG_COMPRESSION_MASK, SEGMENT_SIZE, U32,
+                        CreditRecord, CreditReportWriter)
+
+# Incremental updates for v3 files. append_file writes new or corrected records after the existing data
+# as a delta: its own encrypted segments and index buckets, then a fresh header whose DELT table lists
+# every delta. The old header stays behind as dead bytes. Readers resolve each hashed SIN to its newest
+# copy (last writer wins). compact() rewrites the live records into a single base file again.
+# The delta is fsynced before its header is written, so the previous header is always intact on disk;
+# after a crash mid-append, recover() truncates the file back to it.
+
+class CreditReportDelta:
+    @staticmethod
+    def append_file(filename: str, records: Iterable[CreditRecord], encryption_key: bytes) -> int:
+        latest: Dict[str, CreditRecord] = {} # last writer wins inside one delta too
+        for record in records:
+            latest[hashlib.sha256(record.sin.encode()).hexdigest()] = record
+        if not latest:
+            return 0
+
+        fernet = Fernet(encryption_key)
+        with open(filename, "r+b") as file:
+            if file.read(len(Magic_Number)) != Magic_Number:
+                raise ValueError("Appending requires a v3 file.")
+            header = CreditReportReader._read_header(file, encryption_key)
+            existing = CreditReportReader._locate(file, header, fernet, latest) # SINs this delta supersedes
+            codec = header.flags & FLAG_COMPRESSION_MASK
+            names = CreditReportReader._read_dictionary(file, fernet, header)
+            dictionary = {name: code for code, name in enumerate(names)} if names is not None else None
+
+            end = file.seek(0, 2)
+            try:
+                segments = list(header.segments)
+                first_segment = len(segments)
+                index: Dict[str, tuple] = {}
+                segment = bytearray()
+                segment_records = 0
+                for hashed_sin, record in latest.items():
+                    index[hashed_sin] = (len(segments), len(segment))
+                    segment += CreditReportWriter.encode_record(record, hashed_sin, dictionary)
+                    segment_records += 1
+                    if len(segment) >= SEGMENT_SIZE:
+                        segments.append(CreditReportWriter._write_segment(file, fernet, bytes(segment), segment_records, codec))
+                        segment = bytearray()
+                        segment_records = 0
+                if segment_records:
+                    segments.append(CreditReportWriter._write_segment(file, fernet, bytes(segment), segment_records, codec))
+
+                buckets = CreditReportWriter._write_index_buckets(file, fernet, index, codec)
+                delta = DELTA_ENTRY.pack(first_segment, len(segments) - first_segment, len(buckets))
+                delta += b"".join(BUCKET_ENTRY.pack(*entry) for entry in buckets)
+
+                sections = {tag: data for tag, data in header.sections.items() if tag != b"SEGS"}
+                sections[b"DELT"] = sections.get(b"DELT", b"") + delta
+                if b"BLOM" in sections: # same size as before, so it fills up as deltas are appended
+                    bits = bytearray(sections[b"BLOM"][4:])
+                    CreditReportWriter._bloom_add(bits, encryption_key, index, U32.unpack_from(sections[b"BLOM"])[0])
+                    sections[b"BLOM"] = sections[b"BLOM"][:4] + bytes(bits)
+                if dictionary is not None and len(dictionary) > len(names): # new names: the whole dictionary is rewritten
+                    block = CreditReportWriter._write_block(file, fernet, CreditReportWriter._serialize_dictionary(dictionary), codec)
+                    sections[b"DICT"] = BUCKET_ENTRY.pack(*block)
+                record_count = header.record_count + len(index) - len(existing)
+                file.flush()
+                os.fsync(file.fileno()) # everything the new header points at is on disk before the header is
+                CreditReportWriter._write_header(file, encryption_key, header.flags, record_count, segments, sections)
+                file.flush()
+                os.fsync(file.fileno())
+            except BaseException:
+                file.truncate(end) # leave the previous header as the last thing in the file
+                raise
+        return len(index)
+
+    @staticmethod
+    def recover(filename: str, encryption_key: bytes) -> int:
+        # truncates an append that was cut short (crash, full disk) back to the last complete header, so the file
+        # reads as it did before that append. Returns the number of bytes dropped, 0 if the file was intact
+        with open(filename, "r+b") as file:
+            if file.read(len(Magic_Number)) != Magic_Number:
+                raise ValueError("Recovery requires a v3 file.")
+            end = CreditReportReader._last_header_end(file, encryption_key)
+            if end is None:
+                raise ValueError("No intact header found. Invalid key or not a CRF file.")
+            size = file.seek(0, 2)
+            if end < size:
+                file.truncate(end)
+                os.fsync(file.fileno())
+        return size - end
+
+    @staticmethod
+    def compact(filename: str, encryption_key: bytes, output: str = None, workers: int = 1, new_key: bytes = None):
+        # merges all deltas back into one base file, keeping the compression, secondary indexes and dictionary
+        # encoding of the original; with new_key the compacted file is written under that key instead
+        output = output or filename
+        header = CreditReportReader.read_header(filename, encryption_key)
+        codecs = {codec: name for name, codec in COMPRESSION_CODECS.items()}
+        # the writer builds output + ".tmp" and only replaces output on close, so compacting in place is safe
+        with CreditReportWriter.open(output, new_key or encryption_key, workers=workers,
+                                     compression=codecs[header.flags & FLAG_COMPRESSION_MASK],
+                                     secondary_indexes=header.score_index is not None,
+                                     dictionary=header.dictionary is not None,
+                                     bloom_filter=b"BLOM" in header.sections) as writer:
+            for record in CreditReportReader.iter_records(filename, encryption_key):
+                writer.append(record, hashed_sin=record.sin) # records read back already hold the hashed SIN
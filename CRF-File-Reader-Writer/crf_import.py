@@ -0,0 +1,176 @@
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List
+
+import argparse
+import csv
+import json
+import os
+import time
+
+from crf_writer import Account, CreditRecord, CreditReportWriter
+
+# Bulk import of CSV or JSONL extracts into a v3 file. The input is read as text and cut into chunks of
+# lines; worker processes parse each chunk, hash the SINs and encode the records, and hand back one
+# encoded buffer per chunk, so only bytes cross the process boundary. With `workers` processes in total,
+# workers - 1 parse while this process cuts segments, encrypts and writes them (the writer gets no pool
+# of its own). At most 2 chunks per parser are in flight, so memory stays flat however large the input is.
+#
+# CSV needs a header row with sin, name, address, credit_score and optionally major_flags, account_count
+# and accounts, written as "Chequing:2000;Line of Credit:-5000". JSONL takes one object per line with the
+# same fields, accounts as [{"name": ..., "balance": ...}] or [[name, balance]].
+
+CHUNK_LINES = 10000 # input lines parsed per worker task
+FORMATS = {".csv": "csv", ".jsonl": "jsonl", ".ndjson": "jsonl"}
+
+def _make_record(sin, name, address, credit_score, major_flags, account_count, accounts: List[Account]) -> CreditRecord:
+    if account_count not in (None, "") and int(account_count) != len(accounts):
+        raise ValueError(f"account_count is {account_count} but {len(accounts)} accounts are listed")
+    record = CreditRecord(sin=str(sin), name=name, address=address, credit_score=int(credit_score),
+                          account_count=len(accounts), major_flags=int(major_flags or 0), accounts=accounts)
+    CreditReportWriter._check_record(record) # out-of-range values are reported here, with their line number
+    return record
+
+def _csv_record(row: Dict[str, str]) -> CreditRecord:
+    accounts = []
+    for entry in (row.get("accounts") or "").split(";"):
+        if entry:
+            name, _, balance = entry.rpartition(":") # account names may themselves contain ":"
+            accounts.append(Account(name, int(balance)))
+    return _make_record(row["sin"], row["name"], row["address"], row["credit_score"], row.get("major_flags"),
+                        row.get("account_count"), accounts)
+
+def _json_record(data: dict) -> CreditRecord:
+    accounts = [Account(account["name"], int(account["balance"])) if isinstance(account, dict)
+                else Account(account[0], int(account[1])) for account in data.get("accounts") or ()]
+    return _make_record(data["sin"], data["name"], data["address"], data["credit_score"], data.get("major_flags"),
+                        data.get("account_count"), accounts)
+
+def _parse_chunk(format: str, fieldnames: List[str], lines: List[str], first_line: int, source: str,
+                 dictionary: Dict[str, int] = None) -> tuple:
+    # runs in a worker process: returns _encode_batch's (hashes, sizes, data, new names) plus the credit
+    # scores and major flags the writer needs for its secondary indexes
+    batch = []
+    scores = array("I")
+    flags = array("I")
+    rows = csv.DictReader(lines, fieldnames) if format == "csv" else lines
+    line = first_line - 1
+    for row in rows:
+        try:
+            if format == "csv":
+                line = first_line + rows.line_num - 1
+                record = _csv_record(row)
+            else:
+                line += 1
+                if not row.strip():
+                    continue
+                record = _json_record(json.loads(row))
+        except (KeyError, IndexError, TypeError, ValueError) as e:
+            raise ValueError(f"{source}, line {line}: invalid record ({e!r})") from None
+        batch.append((record, None)) # hashed in _encode_batch, once per SIN
+        scores.append(record.credit_score)
+        flags.append(record.major_flags)
+    return CreditReportWriter._encode_batch(batch, dictionary), scores, flags
+
+class CreditReportImporter:
+    @staticmethod
+    def import_file(source: str, output: str, encryption_key: bytes, format: str = None, workers: int = None,
+                    chunk_lines: int = CHUNK_LINES, **options) -> int:
+        # format is "csv" or "jsonl", by default taken from the file extension; workers is the total process
+        # count including this one, by default the CPU count. options go to CreditReportWriter.open
+        # (compression, secondary_indexes, dictionary, ...). Returns the number of records imported
+        if format is None:
+            format = FORMATS.get(os.path.splitext(source)[1].lower())
+        if format not in ("csv", "jsonl"):
+            raise ValueError(f"Unsupported import format: {format}")
+        workers = workers or os.cpu_count() or 1
+        parsers = workers - 1 # this process does the writer's encryption, so it counts as a worker too
+
+        with open(source, newline="", encoding="utf-8") as file, \
+             CreditReportWriter.open(output, encryption_key, workers=1, **options) as writer:
+            fieldnames = next(csv.reader([file.readline()]), None) if format == "csv" else None
+            if format == "csv" and not fieldnames:
+                raise ValueError(f"{source} has no CSV header row.")
+            chunks = CreditReportImporter._chunks(file, format, chunk_lines, 2 if format == "csv" else 1)
+
+            def parse(first_line, lines):
+                dictionary = writer._dictionary
+                return _parse_chunk(format, fieldnames, lines, first_line, source,
+                                    dict(dictionary) if dictionary is not None else None)
+
+            def add(result, known, chunk):
+                encoded, scores, flags = result
+                if not writer._append_encoded(encoded, known, scores, flags):
+                    encoded, scores, flags = parse(*chunk) # encoded against a stale dictionary, redone here
+                    writer._append_encoded(encoded, len(writer._dictionary), scores, flags)
+
+            if parsers == 0:
+                for chunk in chunks:
+                    add(parse(*chunk), len(writer._dictionary or ()), chunk)
+                return writer.record_count
+
+            pool = ProcessPoolExecutor(max_workers=parsers)
+            pending = deque()
+            try:
+                for chunk in chunks:
+                    dictionary = writer._dictionary
+                    known = len(dictionary) if dictionary is not None else 0
+                    pending.append((pool.submit(_parse_chunk, format, fieldnames, chunk[1], chunk[0], source, dictionary),
+                                    known, chunk))
+                    while len(pending) > parsers * 2: # backpressure: bounded parsed chunks waiting for the writer
+                        future, known, done = pending.popleft()
+                        add(future.result(), known, done)
+                while pending:
+                    future, known, done = pending.popleft()
+                    add(future.result(), known, done)
+            finally:
+                pool.shutdown(cancel_futures=True)
+        return writer.record_count
+
+    @staticmethod
+    def _chunks(file, format: str, chunk_lines: int, first_line: int) -> Iterator[tuple]:
+        # yields (line number of the chunk's first line, lines); a CSV chunk never ends inside a quoted
+        # field, which may span lines
+        lines = []
+        quotes = 0
+        for line in file:
+            lines.append(line)
+            if format == "csv":
+                quotes += line.count('"') # "" escapes keep the count even
+                if quotes % 2:
+                    continue
+            if len(lines) >= chunk_lines:
+                yield first_line, lines
+                first_line += len(lines)
+                lines = []
+        if lines:
+            yield first_line, lines
+
+def main():
+    parser = argparse.ArgumentParser(description="Import a CSV or JSONL extract into a CRF file")
+    parser.add_argument("input")
+    parser.add_argument("output")
+    parser.add_argument("--format", choices=["csv", "jsonl"], help="default: from the input file extension")
+    parser.add_argument("--key-env", default="CRF_KEY", help="environment variable holding the encryption key")
+    parser.add_argument("--workers", type=int, default=None, help="processes in total, including the writer (default: one per CPU)")
+    parser.add_argument("--chunk-lines", type=int, default=CHUNK_LINES)
+    parser.add_argument("--compression", choices=["zlib", "lzma", "zstd"], default=None)
+    parser.add_argument("--secondary-indexes", action="store_true")
+    parser.add_argument("--dictionary", action="store_true")
+    parser.add_argument("--bloom-filter", action="store_true")
+    args = parser.parse_args()
+
+    key = os.environ.get(args.key_env)
+    if not key:
+        parser.error(f"set {args.key_env} to the encryption key")
+    start = time.perf_counter()
+    count = CreditReportImporter.import_file(args.input, args.output, key.encode(), args.format, args.workers,
+                                             args.chunk_lines, compression=args.compression,
+                                             secondary_indexes=args.secondary_indexes, dictionary=args.dictionary,
+                                             bloom_filter=args.bloom_filter)
+    elapsed = time.perf_counter() - start
+    print(f"{count:,} records imported to {args.output} in {elapsed:.1f} s ({count / elapsed:,.0f} records/s)")
+
+if __name__ == "__main__":
+    main()
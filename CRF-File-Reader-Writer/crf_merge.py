@@ -0,0 +1,143 @@
+from functools import reduce
+from itertools import groupby
+from operator import attrgetter
+from typing import Callable, Iterable, List, Union
+
+from cryptography.fernet import Fernet
+import argparse
+import heapq
+import os
+import shutil
+import tempfile
+
+from crf_reader import CreditReportReader, CreditRecord
+from crf_writer import CreditReportWriter
+
+# Merges many CRF files into one indexed file keeping one record per hashed SIN, within a fixed memory
+# budget. Input records are gathered into an in-memory table (duplicates are resolved as they arrive);
+# when its estimated size passes the budget it is written out sorted by hashed SIN as a temporary v3 run,
+# encrypted with a throwaway key. The runs are then k-way merged, at most MERGE_FAN_IN at a time, so only
+# one decrypted segment per open run is held. Inputs listed later count as newer: resolve(older, newer)
+# is applied to each pair of duplicates in that order and should be associative, since intermediate
+# passes resolve part of the duplicates early. The output writer still keeps its SIN index in memory,
+# packed at about 40 bytes per record.
+
+MEMORY_LIMIT = 256 * 1024 * 1024
+MERGE_FAN_IN = 16          # runs merged in one pass; more runs take another pass through intermediate runs
+RECORD_OVERHEAD = 640      # rough Python cost of one buffered record: dataclass, strings, list and table entry
+ACCOUNT_OVERHEAD = 160     # ...and of each of its accounts
+MIN_RUN_SEGMENT = 64 * 1024
+
+def _keep_last(older: CreditRecord, newer: CreditRecord) -> CreditRecord:
+    return newer
+
+def _keep_first(older: CreditRecord, newer: CreditRecord) -> CreditRecord:
+    return older
+
+def _no_duplicates(older: CreditRecord, newer: CreditRecord) -> CreditRecord:
+    raise ValueError(f"Duplicate record for hashed SIN {newer.sin}.")
+
+RESOLVERS = {"last": _keep_last, "first": _keep_first, "error": _no_duplicates}
+
+_sin = attrgetter("sin") # records read back hold the hashed SIN
+
+class CreditReportMerge:
+    @staticmethod
+    def merge_files(filenames: Iterable[str], output: str, encryption_key: bytes,
+                    resolve: Union[str, Callable[[CreditRecord, CreditRecord], CreditRecord]] = "last",
+                    memory_limit: int = MEMORY_LIMIT, temp_dir: str = None, **options) -> int:
+        # resolve is "last" (newest input wins), "first", "error" or a callable; options go to
+        # CreditReportWriter.open for the output (compression, workers, secondary_indexes, ...).
+        # Returns the number of records written
+        if not callable(resolve):
+            if resolve not in RESOLVERS:
+                raise ValueError(f"Unsupported duplicate resolution: {resolve}")
+            resolve = RESOLVERS[resolve]
+        run_key = Fernet.generate_key() # temporary runs are unreadable once this process is gone
+        run_segment = max(MIN_RUN_SEGMENT, memory_limit // (4 * MERGE_FAN_IN))
+        work_dir = tempfile.mkdtemp(prefix="crf_merge_", dir=temp_dir or os.path.dirname(os.path.abspath(output)))
+
+        try:
+            runs: List[str] = []
+            table = {}
+            used = 0
+            for filename in filenames:
+                for record in CreditReportReader.iter_records(filename, encryption_key):
+                    current = table.get(record.sin)
+                    table[record.sin] = record if current is None else resolve(current, record)
+                    used += CreditReportMerge._estimate(record)
+                    if used >= memory_limit:
+                        runs.append(CreditReportMerge._spill(table, work_dir, len(runs), run_key, run_segment))
+                        used = 0
+
+            if runs:
+                if table:
+                    runs.append(CreditReportMerge._spill(table, work_dir, len(runs), run_key, run_segment))
+                while len(runs) > MERGE_FAN_IN: # consecutive groups, so older runs still come first
+                    runs = [CreditReportMerge._write_run(
+                                CreditReportMerge._merge_runs(runs[i:i + MERGE_FAN_IN], run_key, resolve),
+                                os.path.join(work_dir, f"pass{len(runs)}_{i // MERGE_FAN_IN}.crf"), run_key, run_segment)
+                            for i in range(0, len(runs), MERGE_FAN_IN)]
+                records = CreditReportMerge._merge_runs(runs, run_key, resolve)
+            else: # everything fit in memory
+                records = (table.pop(sin_hash) for sin_hash in sorted(table))
+
+            # output is written with the newest key when a rotation list is given; it is only replaced on close
+            with CreditReportWriter.open(output, CreditReportReader._keys(encryption_key)[0], **options) as writer:
+                for record in records:
+                    writer.append(record, hashed_sin=record.sin)
+            return writer.record_count
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    @staticmethod
+    def _estimate(record: CreditRecord) -> int:
+        return (RECORD_OVERHEAD + len(record.name) + len(record.address)
+                + sum(ACCOUNT_OVERHEAD + len(account.name) for account in record.accounts))
+
+    @staticmethod
+    def _spill(table: dict, work_dir: str, number: int, run_key: bytes, segment_size: int) -> str:
+        # records leave the table as they are written, so the table shrinks while the run's index grows
+        records = (table.pop(sin_hash) for sin_hash in sorted(table))
+        return CreditReportMerge._write_run(records, os.path.join(work_dir, f"run{number}.crf"), run_key, segment_size)
+
+    @staticmethod
+    def _write_run(records: Iterable[CreditRecord], path: str, run_key: bytes, segment_size: int) -> str:
+        with CreditReportWriter.open(path, run_key, segment_size=segment_size) as writer:
+            for record in records:
+                writer.append(record, hashed_sin=record.sin)
+        return path
+
+    @staticmethod
+    def _merge_runs(runs: List[str], run_key: bytes, resolve):
+        # heapq.merge is stable, so duplicates arrive from the oldest run to the newest
+        streams = [CreditReportReader.iter_records(run, run_key) for run in runs]
+        for _, group in groupby(heapq.merge(*streams, key=_sin), key=_sin):
+            yield reduce(resolve, group)
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge CRF files, keeping one record per SIN")
+    parser.add_argument("output")
+    parser.add_argument("inputs", nargs="+", help="input files, oldest first")
+    parser.add_argument("--key-env", default="CRF_KEY", help="environment variable holding the encryption key")
+    parser.add_argument("--resolve", choices=sorted(RESOLVERS), default="last")
+    parser.add_argument("--memory-mb", type=int, default=MEMORY_LIMIT // (1024 * 1024))
+    parser.add_argument("--temp-dir")
+    parser.add_argument("--compression", choices=["zlib", "lzma", "zstd"], default=None)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--secondary-indexes", action="store_true")
+    parser.add_argument("--dictionary", action="store_true")
+    parser.add_argument("--bloom-filter", action="store_true")
+    args = parser.parse_args()
+
+    key = os.environ.get(args.key_env)
+    if not key:
+        parser.error(f"set {args.key_env} to the encryption key")
+    count = CreditReportMerge.merge_files(args.inputs, args.output, key.encode(), args.resolve, args.memory_mb * 1024 * 1024,
+                                          args.temp_dir, compression=args.compression, workers=args.workers,
+                                          secondary_indexes=args.secondary_indexes, dictionary=args.dictionary,
+                                          bloom_filter=args.bloom_filter)
+    print(f"{count:,} records written to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,70 @@
-from dataclasses import dataclass # structuring
-from typing import List
+from dataclasses import dataclass, field # structuring
+from typing import Dict, Iterable, List, Optional, Tuple
 
+import base64
+import hashlib
+import hmac
+import lzma
 import struct
+import sys
 import zlib
 
-from cryptography.fernet import Fernet
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from cryptography.fernet import Fernet, MultiFernet
+from time import perf_counter
 import io
+import os
+
+from crf_cache import CRFCache
+from crf_stats import CRFStats
+
+try:
+    import numpy as np # only needed for read_columns
+except ImportError:
+    np = None
+
+try:
+    import zstandard # only needed for zstd-compressed files
+except ImportError:
+    zstandard = None
 
 Magic_Number = b"CRF"
 Footer = b"CRF_END"
+VERSION = 3
+
+SEGMENT_ENTRY = struct.Struct("<QII32s") # segment file offset, token length, record count, SHA-256 of the token
+BUCKET_ENTRY = struct.Struct("<QI32s") # index bucket file offset, token length, SHA-256 of the token
+DELTA_ENTRY = struct.Struct("<III") # delta first segment, segment count, bucket count; bucket entries follow
+HEADER = struct.Struct("<3sHHIIQI32s") # magic, version, flags, record count, segment count, tables offset/length/digest
+SECTION = struct.Struct("<4sI") # tag + length of each block in the header tables
+MAC_SIZE = 32 # HMAC-SHA256 over the plaintext header
+RECOVERY_CHUNK = 1024 * 1024 # bytes read at a time while searching backwards for the last intact header
+BLOOM_PROBE = struct.Struct("<QQ") # two 64-bit hashes, combined into the filter's bit positions
+
+# precompiled record codec, shared by every decode path
+U32 = struct.Struct("<I")
+FIXED_FIELDS = struct.Struct("<III") # credit_score, account_count, major_flags in one unpack
+BALANCE = struct.Struct("<i")
+INDEX_LOCATION = struct.Struct("<II") # segment number, offset inside the segment
+DICTIONARY_CODE = 0x80000000 # high bit of an account name's length prefix: the rest is a code into the file's dictionary
+
+# columns scan() can project; "balances" is the account balances without decoding the account names
+SCAN_COLUMNS = ("sin", "name", "address", "credit_score", "account_count", "major_flags", "accounts", "balances")
+
+# rough in-memory sizes of parsed structures, counted against a CRFCache's memory budget
+INDEX_ENTRY_COST = 200       # hashed SIN string, location tuple and dict slot
+DICTIONARY_ENTRY_COST = 80
+HEADER_ENTRY_COST = 1024
+
+# compression codec ids, stored in the low bits of the header flags
+COMPRESSION_NONE = 0
+COMPRESSION_ZLIB = 1
+COMPRESSION_LZMA = 2
+COMPRESSION_ZSTD = 3
+FLAG_COMPRESSION_MASK = 0x000F
 
 @dataclass
 class Account:
@@ -30,27 +86,434 @@ class FileMetaData:
     version: int
     record_count: int
 
+@dataclass
+class FileHeader: # authenticated plaintext header of a v3 file
+    version: int
+    flags: int
+    record_count: int
+    segment_count: int
+    sections: Dict[bytes, bytes] = field(default_factory=dict)
+    segments: List[tuple] = field(default_factory=list) # (offset, length, record count, token digest)
+    buckets: List[tuple] = field(default_factory=list) # (offset, length, token digest), like the blocks below
+    deltas: List[tuple] = field(default_factory=list) # (first segment, segment count, buckets) per appended delta
+    score_index: Optional[tuple] = None # credit_score index block, when it was written
+    dictionary: Optional[tuple] = None # account name dictionary block, when it was written
+    flag_index: Optional[tuple] = None # major_flags bitmaps block, when they were written
+    cache_key: Optional[tuple] = field(default=None, repr=False, compare=False) # set when read through a CRFCache
+
+@dataclass
+class RecordColumns: # column-per-field view, balances of record i are balances[balance_offsets[i]:balance_offsets[i + 1]]
+    credit_score: "np.ndarray"
+    account_count: "np.ndarray"
+    major_flags: "np.ndarray"
+    balances: "np.ndarray"
+    balance_offsets: "np.ndarray"
+    sin: Optional[List[str]] = None # string columns are only filled when requested
+    name: Optional[List[str]] = None
+    address: Optional[List[str]] = None
+    account_names: Optional[List[str]] = None # flattened like balances
+
+class CreditRecordView:
+    # read-only record that keeps a reference to its decrypted segment and its offset in it; each field is decoded
+    # the first time it is read and strings are cached, so untouched records cost one small object each
+    __slots__ = ("_buffer", "_offset", "_dictionary", "_sin", "_name", "_address", "_accounts")
+
+    def __init__(self, buffer: bytes, offset: int, dictionary: List[str] = None):
+        self._buffer = buffer
+        self._offset = offset
+        self._dictionary = dictionary
+        self._sin = self._name = self._address = self._accounts = None
+
+    def _string(self, field_number: int) -> str: # 0 sin, 1 name, 2 address
+        buffer = self._buffer
+        position = self._offset
+        for _ in range(field_number):
+            position += 4 + U32.unpack_from(buffer, position)[0]
+        length = U32.unpack_from(buffer, position)[0]
+        return buffer[position + 4:position + 4 + length].decode("utf-8")
+
+    def _fixed_offset(self) -> int:
+        position = self._offset
+        for _ in range(3):
+            position += 4 + U32.unpack_from(self._buffer, position)[0]
+        return position
+
+    @property
+    def sin(self) -> str:
+        if self._sin is None:
+            self._sin = self._string(0)
+        return self._sin
+
+    @property
+    def name(self) -> str:
+        if self._name is None:
+            self._name = self._string(1)
+        return self._name
+
+    @property
+    def address(self) -> str:
+        if self._address is None:
+            self._address = self._string(2)
+        return self._address
+
+    @property
+    def credit_score(self) -> int:
+        return U32.unpack_from(self._buffer, self._fixed_offset())[0]
+
+    @property
+    def account_count(self) -> int:
+        return U32.unpack_from(self._buffer, self._fixed_offset() + 4)[0]
+
+    @property
+    def major_flags(self) -> int:
+        return U32.unpack_from(self._buffer, self._fixed_offset() + 8)[0]
+
+    @property
+    def accounts(self) -> List[Account]:
+        if self._accounts is None:
+            self._accounts = CreditReportReader.decode_record(self._buffer, self._offset, self._dictionary)[0].accounts
+        return self._accounts
+
+    def to_record(self) -> CreditRecord:
+        return CreditReportReader.decode_record(self._buffer, self._offset, self._dictionary)[0]
+
+    def __repr__(self):
+        return f"CreditRecordView(sin={self.sin!r}, credit_score={self.credit_score})"
+
+@dataclass
+class FileReadResult: # outcome of one file in read_many, error is set instead of raising
+    filename: str
+    records: Optional[List[CreditRecord]] = None
+    error: Optional[Exception] = None
+
 class CreditReportReader:
+    cache: Optional[CRFCache] = None # opt-in, e.g. CreditReportReader.cache = CRFCache(); see crf_cache.py
+
     @staticmethod
     def read_string(f):
         length_bytes = f.read(4) # reads first 4 bytes
         if not length_bytes: # checks if end of the file
             return None
-        length = struct.unpack("<I", length_bytes)[0] # converts 4 bytes into int
+        length = U32.unpack(length_bytes)[0] # converts 4 bytes into int
         return f.read(length).decode("utf-8") # converts back into python string
     
     @staticmethod
-    def read_file(filename: str, encryption_key: bytes):
+    def read_record(f, dictionary: List[str] = None) -> CreditRecord:
+        # stream counterpart of decode_record; dictionary is the file's account name dictionary, if it has one
+        sin = CreditReportReader.read_string(f)
+        name = CreditReportReader.read_string(f)
+        address = CreditReportReader.read_string(f)
+        credit_score, account_count, major_flags = FIXED_FIELDS.unpack(f.read(FIXED_FIELDS.size))
+
+        accounts = []
+        for _ in range(account_count):
+            length = U32.unpack(f.read(4))[0]
+            if length & DICTIONARY_CODE:
+                if dictionary is None:
+                    raise ValueError("Dictionary-coded account name but no dictionary given.")
+                acc_name = dictionary[length ^ DICTIONARY_CODE]
+            else:
+                acc_name = f.read(length).decode("utf-8")
+            balance = BALANCE.unpack(f.read(4))[0]
+            accounts.append(Account(acc_name, balance))
+
+        return CreditRecord(sin, name, address, credit_score, account_count, major_flags, accounts)
+
+    @staticmethod
+    def decode_record(buffer, offset: int = 0, dictionary: List[str] = None) -> tuple:
+        # parses straight out of the decrypted bytes with unpack_from, no BytesIO and no per-field reads;
+        # only string fields are sliced (bytes.decode beats decoding a memoryview slice). Dictionary-coded
+        # account names come from the file's dictionary. Returns the record and the offset of the next one
+        unpack_u32 = U32.unpack_from
+        length = unpack_u32(buffer, offset)[0]
+        offset += 4
+        sin = buffer[offset:offset + length].decode("utf-8")
+        offset += length
+        length = unpack_u32(buffer, offset)[0]
+        offset += 4
+        name = buffer[offset:offset + length].decode("utf-8")
+        offset += length
+        length = unpack_u32(buffer, offset)[0]
+        offset += 4
+        address = buffer[offset:offset + length].decode("utf-8")
+        offset += length
+        credit_score, account_count, major_flags = FIXED_FIELDS.unpack_from(buffer, offset)
+        offset += 12
+
+        accounts = []
+        for _ in range(account_count):
+            length = unpack_u32(buffer, offset)[0]
+            offset += 4
+            if length & DICTIONARY_CODE:
+                acc_name = dictionary[length ^ DICTIONARY_CODE] # interned, shared by every record
+            else:
+                acc_name = buffer[offset:offset + length].decode("utf-8")
+                offset += length
+            accounts.append(Account(acc_name, BALANCE.unpack_from(buffer, offset)[0]))
+            offset += 4
+
+        return CreditRecord(sin, name, address, credit_score, account_count, major_flags, accounts), offset
+
+    @staticmethod
+    def _skip_record(buffer, position: int) -> int:
+        for _ in range(3): # sin, name, address
+            position += 4 + U32.unpack_from(buffer, position)[0]
+        account_count = U32.unpack_from(buffer, position + 4)[0]
+        position += FIXED_FIELDS.size
+        for _ in range(account_count):
+            length = U32.unpack_from(buffer, position)[0]
+            position += 8 if length & DICTIONARY_CODE else 8 + length
+        return position
+
+    @staticmethod
+    def read_file(filename: str, encryption_key: bytes, stats: CRFStats = None):
+        return list(CreditReportReader.iter_records(filename, encryption_key, stats=stats))
+
+    @staticmethod
+    def read_many(files: Iterable[Tuple[str, bytes]], workers: int = None, ordered: bool = True):
+        # decrypts and parses (filename, key) pairs across a process pool, yielding a FileReadResult per file;
+        # at most 2 * workers files are in flight so results stream instead of piling up
+        workers = workers or os.cpu_count() or 1
+        files = iter(files)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            def submit():
+                job = next(files, None)
+                if job is None:
+                    return None
+                filename, encryption_key = job
+                return filename, pool.submit(CreditReportReader.read_file, filename, encryption_key)
+
+            pending = deque()
+            for _ in range(workers * 2):
+                job = submit()
+                if job is None:
+                    break
+                pending.append(job)
+
+            while pending:
+                if ordered:
+                    filename, future = pending.popleft()
+                else:
+                    done, _ = wait([future for _, future in pending], return_when=FIRST_COMPLETED)
+                    filename, future = next(job for job in pending if job[1] in done)
+                    pending.remove((filename, future))
+                try:
+                    yield FileReadResult(filename, records = future.result())
+                except Exception as e: # bad key, checksum mismatch, missing file... reported, not raised
+                    yield FileReadResult(filename, error = e)
+                job = submit()
+                if job is not None:
+                    pending.append(job)
+
+    @staticmethod
+    def iter_records(filename: str, encryption_key: bytes, batch_size: int = None, stats: CRFStats = None):
+        records = CreditReportReader._iter_records(filename, encryption_key, stats)
+        if batch_size is None:
+            yield from records
+            return
+
+        batch = [] # hand records out in lists of batch_size
+        for record in records:
+            batch.append(record)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    @staticmethod
+    def iter_views(filename: str, encryption_key: bytes):
+        # like iter_records, but yields CreditRecordView objects that decode fields on access;
+        # views of one segment share its decrypted buffer, which stays alive while any of them does
+        skip = CreditReportReader._skip_record
+        for buffer, position, record_count, dropped, dictionary in CreditReportReader._iter_blocks(filename, encryption_key):
+            for _ in range(record_count):
+                start = position
+                position = skip(buffer, position)
+                if not (dropped and start in dropped): # superseded by a newer delta
+                    yield CreditRecordView(buffer, start, dictionary)
+
+    @staticmethod
+    def read_views(filename: str, encryption_key: bytes) -> List[CreditRecordView]:
+        return list(CreditReportReader.iter_views(filename, encryption_key))
+
+    @staticmethod
+    def _iter_records(filename: str, encryption_key: bytes, stats: CRFStats = None):
+        decode = CreditReportReader.decode_record
+        for buffer, position, record_count, dropped, dictionary in CreditReportReader._iter_blocks(filename, encryption_key, stats):
+            if stats is not None: # decode the whole block up front, so the consumer's time is not counted as decoding
+                started = perf_counter()
+                records = []
+                for _ in range(record_count):
+                    start = position
+                    record, position = decode(buffer, position, dictionary)
+                    if not (dropped and start in dropped):
+                        records.append(record)
+                stats.add("decode", perf_counter() - started, len(buffer))
+                stats.records += len(records)
+                yield from records
+                continue
+            if not dropped:
+                for _ in range(record_count):
+                    record, position = decode(buffer, position, dictionary)
+                    yield record
+                continue
+            for _ in range(record_count):
+                start = position
+                record, position = decode(buffer, position, dictionary)
+                if start not in dropped: # superseded by a newer delta
+                    yield record
+
+    @staticmethod
+    def scan(filename: str, encryption_key: bytes, columns: Iterable[str] = None, where=None):
+        # yields a dict per record holding only the requested columns (every CreditRecord field by default).
+        # where(credit_score, account_count, major_flags) is checked on the fixed fields before any string is
+        # decoded; strings that are filtered out or not requested are skipped by their length prefixes
+        columns = tuple(SCAN_COLUMNS[:-1] if columns is None else columns)
+        for column in columns:
+            if column not in SCAN_COLUMNS:
+                raise ValueError(f"Unknown column: {column}")
+        strings = [(column, slot) for slot, column in enumerate(("sin", "name", "address")) if column in columns]
+        fixed = [(column, slot) for slot, column in enumerate(("credit_score", "account_count", "major_flags")) if column in columns]
+        want_accounts = "accounts" in columns
+        want_balances = "balances" in columns
+        unpack_u32 = U32.unpack_from
+        unpack_fixed = FIXED_FIELDS.unpack_from
+        unpack_balance = BALANCE.unpack_from
+
+        skip = CreditReportReader._skip_record
+        for buffer, position, record_count, dropped, dictionary in CreditReportReader._iter_blocks(filename, encryption_key):
+            for _ in range(record_count):
+                start = position # sin, name and address: remember where they start, decode nothing yet
+                name_at = position + 4 + unpack_u32(buffer, position)[0]
+                address_at = name_at + 4 + unpack_u32(buffer, name_at)[0]
+                position = address_at + 4 + unpack_u32(buffer, address_at)[0]
+                values = unpack_fixed(buffer, position)
+                position += 12
+                account_count = values[1]
+
+                if (dropped and start in dropped) or (where is not None and not where(*values)):
+                    position = skip(buffer, start)
+                    continue
 
+                row = {}
+                for column, slot in strings:
+                    string_at = (start, name_at, address_at)[slot]
+                    length = unpack_u32(buffer, string_at)[0]
+                    row[column] = buffer[string_at + 4:string_at + 4 + length].decode("utf-8")
+                for column, slot in fixed:
+                    row[column] = values[slot]
+                if want_accounts or want_balances:
+                    accounts, balances = [], []
+                    for _ in range(account_count):
+                        length = unpack_u32(buffer, position)[0]
+                        position += 4
+                        if length & DICTIONARY_CODE: # coded name, nothing inline
+                            acc_name = dictionary[length ^ DICTIONARY_CODE]
+                            length = 0
+                        elif want_accounts:
+                            acc_name = buffer[position:position + length].decode("utf-8")
+                        balance = unpack_balance(buffer, position + length)[0]
+                        if want_accounts:
+                            accounts.append(Account(acc_name, balance))
+                        balances.append(balance)
+                        position += length + 4
+                    if want_accounts:
+                        row["accounts"] = accounts
+                    if want_balances:
+                        row["balances"] = balances
+                else:
+                    position = skip(buffer, start)
+                yield row
+
+    @staticmethod
+    def read_columns(filename: str, encryption_key: bytes, strings: bool = False) -> RecordColumns:
+        if np is None:
+            raise ImportError("read_columns requires numpy.")
+
+        # typed arrays instead of Python lists, handed to numpy without a copy at the end
+        credit_scores, account_counts, major_flags = array("I"), array("I"), array("I")
+        balances, balance_offsets = array("i"), array("q", [0])
+        sins, names, addresses, account_names = [], [], [], []
+        unpack_u32 = U32.unpack_from
+        unpack_fixed = FIXED_FIELDS.unpack_from
+        unpack_balance = BALANCE.unpack_from
+
+        for buffer, position, record_count, dropped, dictionary in CreditReportReader._iter_blocks(filename, encryption_key):
+            for _ in range(record_count):
+                if dropped and position in dropped: # superseded by a newer delta
+                    position = CreditReportReader._skip_record(buffer, position)
+                    continue
+                if strings:
+                    for column in (sins, names, addresses):
+                        length = unpack_u32(buffer, position)[0]
+                        column.append(buffer[position + 4:position + 4 + length].decode("utf-8"))
+                        position += 4 + length
+                else:
+                    for _ in range(3): # skip sin, name and address using their length prefixes
+                        position += 4 + unpack_u32(buffer, position)[0]
+                credit_score, account_count, flags = unpack_fixed(buffer, position)
+                position += 12
+                credit_scores.append(credit_score)
+                account_counts.append(account_count)
+                major_flags.append(flags)
+                for _ in range(account_count):
+                    length = unpack_u32(buffer, position)[0]
+                    if length & DICTIONARY_CODE:
+                        if strings:
+                            account_names.append(dictionary[length ^ DICTIONARY_CODE])
+                        length = 0
+                    elif strings:
+                        account_names.append(buffer[position + 4:position + 4 + length].decode("utf-8"))
+                    position += 4 + length
+                    balances.append(unpack_balance(buffer, position)[0])
+                    position += 4
+                balance_offsets.append(len(balances))
+
+        return RecordColumns(
+            credit_score = np.frombuffer(credit_scores, dtype=np.uint32),
+            account_count = np.frombuffer(account_counts, dtype=np.uint32),
+            major_flags = np.frombuffer(major_flags, dtype=np.uint32),
+            balances = np.frombuffer(balances, dtype=np.int32),
+            balance_offsets = np.frombuffer(balance_offsets, dtype=np.int64),
+            sin = sins if strings else None,
+            name = names if strings else None,
+            address = addresses if strings else None,
+            account_names = account_names if strings else None,
+        )
+
+    @staticmethod
+    def _iter_blocks(filename: str, encryption_key: bytes, stats: CRFStats = None):
+        # yields (decrypted buffer, offset of its first record, record count, offsets of superseded records
+        # or None, account name dictionary or None): one per v3 segment, or the single decrypted token of a v1/v2 file
         with open(filename, "rb") as file:
-            encrypted_data = file.read() # read encrypted data from file
+            if file.read(len(Magic_Number)) == Magic_Number: # v3 files start with a plaintext preamble
+                fernet = CreditReportReader._fernet(encryption_key)
+                started = perf_counter() if stats is not None else 0
+                header = CreditReportReader._read_header(file, encryption_key)
+                parsed = perf_counter() if stats is not None else 0
+                dropped = CreditReportReader._superseded(file, header, fernet)
+                dictionary = CreditReportReader._read_dictionary(file, fernet, header)
+                if stats is not None:
+                    stats.add("header", parsed - started, sum(len(data) for data in header.sections.values()))
+                    stats.add("index", perf_counter() - parsed)
+                stored = sum(entry[2] for entry in header.segments)
+                if stored - sum(len(offsets) for offsets in dropped.values()) != header.record_count:
+                    raise ValueError("Record count mismatch.")
+                for number, segment in enumerate(header.segments): # one segment at a time
+                    buffer = CreditReportReader._read_block(file, fernet, header, segment, stats)
+                    yield buffer, 0, segment[2], dropped.get(number), dictionary
+                return
+            decrypted_data = CreditReportReader._read_legacy(file, encryption_key, stats)
 
-        try:
-            fernet = Fernet(encryption_key) # uses encryption key to decrpyt
-            decrypted_data = fernet.decrypt(encrypted_data)
-        except Exception as e:
-            raise ValueError(f"Decryption failed. Invalid key or corrupted file: {e}")
+        started = perf_counter() if stats is not None else 0
+        records_start, record_count, _ = CreditReportReader._parse_legacy(decrypted_data)
+        if stats is not None:
+            stats.add("header", perf_counter() - started, records_start)
+        yield decrypted_data, records_start, record_count, None, None
 
+    @staticmethod
+    def _parse_legacy(decrypted_data: bytes) -> tuple:
         f = io.BytesIO(decrypted_data) # parse decrypted data from in-memory buffer
 
         if f.read(3) != Magic_Number: # error handling for non crf files
@@ -62,34 +525,14 @@ class CreditReportReader:
 
         record_count = struct.unpack("<I", f.read(4))[0]
         index_size = struct.unpack("<I", f.read(4))[0]
-        f.read(index_size)
-        records = [] # creates empty list to hold records
-
-        for _ in range(record_count):
-            sin = CreditReportReader.read_string(f)
-            name = CreditReportReader.read_string(f)
-            address = CreditReportReader.read_string(f)
-            credit_score = struct.unpack("<I", f.read(4))[0]
-            account_count = struct.unpack("<I", f.read(4))[0]
-            major_flags = struct.unpack("<I", f.read(4))[0]
-
-            accounts = []
-            for _ in range(account_count):
-                acc_name = CreditReportReader.read_string(f)
-                balance = struct.unpack("<i", f.read(4))[0]
-                accounts.append(Account(acc_name, balance))
-
-            records.append(CreditRecord(sin, name, address, credit_score, account_count, major_flags, accounts))
-
-        footer = f.read(len(Footer))
-        if footer != Footer:
-            raise ValueError("Invalid Footer.")
-        
-        footer_record_count = struct.unpack("<I", f.read(4))[0]
-        checksum_stored = struct.unpack("<I", f.read(4))[0]
+        index_start = f.tell()
 
         f.seek(-len(Footer)-4-4, 2) # finds footer start
         footer_data = f.read(len(Footer)+4)
+        if footer_data[:len(Footer)] != Footer:
+            raise ValueError("Invalid Footer.")
+        footer_record_count = struct.unpack("<I", footer_data[len(Footer):])[0]
+        checksum_stored = struct.unpack("<I", f.read(4))[0]
         checksum_calculated = zlib.crc32(footer_data) # verify the checksum
 
         if checksum_calculated != checksum_stored:
@@ -97,19 +540,247 @@ class CreditReportReader:
         if footer_record_count != record_count:
             raise ValueError("Record count mismatch.")
 
-        return records
-    
+        return index_start + index_size, record_count, index_start # records start right after the index
+
     @staticmethod
-    def read_metadata(filename: str, encryption_key: bytes) -> FileMetaData:
-        with open(filename, "rb") as file:
-            encrypted_data = file.read()
+    def _keys(encryption_key) -> list:
+        # every reader entry point takes one key, or a list of keys during a rotation window (newest first)
+        return list(encryption_key) if isinstance(encryption_key, (list, tuple)) else [encryption_key]
+
+    @staticmethod
+    def _fernet(encryption_key):
+        keys = CreditReportReader._keys(encryption_key)
+        if len(keys) == 1:
+            return Fernet(keys[0])
+        return MultiFernet([Fernet(key) for key in keys]) # tries each key in turn, like Fernet.decrypt
 
+    @staticmethod
+    def _decrypt(fernet: Fernet, token: bytes) -> bytes:
         try:
-            fernet = Fernet(encryption_key)
-            decrypted_data = fernet.decrypt(encrypted_data)
+            return fernet.decrypt(token)
         except Exception as e:
-            raise ValueError(f"Decryption failed: {e}")
-        
+            raise ValueError(f"Decryption failed. Invalid key or corrupted file: {e}")
+
+    @staticmethod
+    def _read_block(file, fernet: Fernet, header: FileHeader, block: tuple, stats: CRFStats = None) -> bytes:
+        # reads and opens the token of a segment or index block, or takes it from the cache when one is set
+        cache = CreditReportReader.cache
+        if cache is not None and header.cache_key is not None:
+            buffer = cache.get((header.cache_key, block[0]))
+            if buffer is not None:
+                return buffer
+        if stats is None:
+            buffer = CreditReportReader._open_block(fernet, CreditReportReader._read_token(file, block), header.flags)
+        else:
+            started = perf_counter()
+            token = CreditReportReader._read_token(file, block)
+            stats.add("io", perf_counter() - started, len(token))
+            buffer = CreditReportReader._open_block(fernet, token, header.flags, stats)
+        if cache is not None and header.cache_key is not None:
+            cache.put((header.cache_key, block[0]), buffer, len(buffer))
+        return buffer
+
+    @staticmethod
+    def _read_token(file, block: tuple) -> bytes:
+        # the token at block = (offset, length, ..., SHA-256); the digest comes from the authenticated header
+        # tables, so a token moved from another position or another file under the same key is rejected
+        file.seek(block[0])
+        token = file.read(block[1])
+        if hashlib.sha256(token).digest() != block[-1]:
+            raise ValueError("Block digest mismatch. Corrupted or tampered file.")
+        return token
+
+    @staticmethod
+    def _read_legacy(file, encryption_key: bytes, stats: CRFStats = None) -> bytes:
+        # the decrypted single token of a v1/v2 file, cached whole when a cache is set
+        cache = CreditReportReader.cache
+        if cache is not None:
+            cache_key = (cache.file_key(file, encryption_key), "legacy")
+            decrypted_data = cache.get(cache_key)
+            if decrypted_data is not None:
+                return decrypted_data
+        file.seek(0)
+        started = perf_counter() if stats is not None else 0
+        encrypted_data = file.read() # read encrypted data from file
+        if stats is not None:
+            stats.add("io", perf_counter() - started, len(encrypted_data))
+        decrypted_data = CreditReportReader._open_block(CreditReportReader._fernet(encryption_key), encrypted_data, 0, stats)
+        if cache is not None:
+            cache.put(cache_key, decrypted_data, len(decrypted_data))
+        return decrypted_data
+
+    @staticmethod
+    def _open_block(fernet: Fernet, token: bytes, flags: int, stats: CRFStats = None) -> bytes:
+        # decrypts a segment or index bucket and undoes the compression recorded in the header flags
+        codec = flags & FLAG_COMPRESSION_MASK
+        if stats is None:
+            return CreditReportReader._decompress(codec, CreditReportReader._decrypt(fernet, token))
+        started = perf_counter()
+        data = CreditReportReader._decrypt(fernet, token)
+        decrypted = perf_counter()
+        stats.add("decrypt", decrypted - started, len(token))
+        if codec == COMPRESSION_NONE:
+            return data
+        data = CreditReportReader._decompress(codec, data)
+        stats.add("decompress", perf_counter() - decrypted, len(data))
+        return data
+
+    @staticmethod
+    def _decompress(codec: int, data: bytes) -> bytes:
+        if codec == COMPRESSION_NONE:
+            return data
+        if codec == COMPRESSION_ZLIB:
+            return zlib.decompress(data)
+        if codec == COMPRESSION_LZMA:
+            return lzma.decompress(data)
+        if codec == COMPRESSION_ZSTD:
+            if zstandard is None:
+                raise ImportError("Reading zstd-compressed files requires the zstandard package.")
+            return zstandard.ZstdDecompressor().decompress(data)
+        raise ValueError(f"Unsupported compression codec: {codec}")
+
+    @staticmethod
+    def read_header(filename: str, encryption_key: bytes) -> FileHeader:
+        with open(filename, "rb") as file:
+            if file.read(len(Magic_Number)) != Magic_Number:
+                raise ValueError("Only v3 files have a plaintext header.")
+            return CreditReportReader._read_header(file, encryption_key)
+
+    @staticmethod
+    def encrypted_blocks(header: FileHeader) -> List[tuple]:
+        # (offset, length, digest) of every live Fernet token in a v3 file, for tools that work on tokens without parsing them
+        blocks = [(offset, length, digest) for offset, length, _, digest in header.segments]
+        blocks += header.buckets
+        for _, _, buckets in header.deltas:
+            blocks += buckets
+        blocks += [block for block in (header.score_index, header.flag_index, header.dictionary) if block is not None]
+        return blocks
+
+    @staticmethod
+    def _mac_key(encryption_key: bytes) -> bytes:
+        # derived from the Fernet key so the header MAC never reuses Fernet's own signing key
+        return hmac.new(base64.urlsafe_b64decode(encryption_key), b"CRF header", hashlib.sha256).digest()
+
+    @staticmethod
+    def _bloom_key(encryption_key: bytes) -> bytes:
+        # must match CreditReportWriter._bloom_key, or might_contain gives false negatives
+        return hmac.new(base64.urlsafe_b64decode(encryption_key), b"CRF bloom", hashlib.sha256).digest()
+
+    @staticmethod
+    def _read_header(file, encryption_key: bytes, tables: bool = True) -> FileHeader:
+        cache = CreditReportReader.cache
+        if cache is not None: # a cached header was authenticated with the same key when it was stored
+            cache_key = cache.file_key(file, encryption_key)
+            header = cache.get((cache_key, "header" if tables else "metadata")) # metadata: the header without its tables
+            if header is not None:
+                return header
+
+        size = file.seek(0, 2)
+        if size < len(Magic_Number) + 2 + HEADER.size + MAC_SIZE + len(Footer): # too short for preamble and trailer
+            raise ValueError("Invalid File Format.")
+        file.seek(size - HEADER.size - MAC_SIZE - len(Footer)) # fixed-size header sits right before the Footer marker
+        header_data = file.read(HEADER.size)
+        mac = file.read(MAC_SIZE)
+        if file.read(len(Footer)) != Footer:
+            raise ValueError("Invalid Footer.")
+
+        for key in CreditReportReader._keys(encryption_key):
+            expected = hmac.new(CreditReportReader._mac_key(key), header_data, hashlib.sha256).digest()
+            if hmac.compare_digest(mac, expected):
+                break
+        else:
+            raise ValueError("Header authentication failed. Invalid key or corrupted file.")
+
+        magic, version, flags, record_count, segment_count, tables_offset, tables_length, digest = HEADER.unpack(header_data)
+        if magic != Magic_Number:
+            raise ValueError("Invalid File Format.")
+        if version != VERSION:
+            raise ValueError(f"Unsupported file version: {version}")
+        header = FileHeader(version, flags, record_count, segment_count)
+        if not tables:
+            if cache is not None:
+                header.cache_key = cache_key
+                cache.put((cache_key, "metadata"), header, HEADER_ENTRY_COST)
+            return header
+
+        file.seek(tables_offset)
+        tables_data = file.read(tables_length)
+        if hashlib.sha256(tables_data).digest() != digest: # tables are covered by the MAC through their digest
+            raise ValueError("Header tables checksum mismatch.")
+        position = 0
+        while position < len(tables_data):
+            tag, length = SECTION.unpack_from(tables_data, position)
+            position += SECTION.size
+            header.sections[tag] = tables_data[position:position + length]
+            position += length
+
+        header.segments = list(SEGMENT_ENTRY.iter_unpack(header.sections[b"SEGS"]))
+        header.buckets = list(BUCKET_ENTRY.iter_unpack(header.sections[b"IDXB"]))
+        if b"SCOR" in header.sections:
+            header.score_index = BUCKET_ENTRY.unpack(header.sections[b"SCOR"])
+        if b"FLAG" in header.sections:
+            header.flag_index = BUCKET_ENTRY.unpack(header.sections[b"FLAG"])
+        if b"DICT" in header.sections:
+            header.dictionary = BUCKET_ENTRY.unpack(header.sections[b"DICT"])
+
+        deltas = header.sections.get(b"DELT", b"")
+        position = 0
+        while position < len(deltas):
+            first_segment, segment_count, bucket_count = DELTA_ENTRY.unpack_from(deltas, position)
+            position += DELTA_ENTRY.size
+            buckets = [BUCKET_ENTRY.unpack_from(deltas, position + i * BUCKET_ENTRY.size) for i in range(bucket_count)]
+            position += bucket_count * BUCKET_ENTRY.size
+            header.deltas.append((first_segment, segment_count, buckets))
+        if cache is not None:
+            header.cache_key = cache_key
+            cache.put((cache_key, "header"), header, len(tables_data) + HEADER_ENTRY_COST)
+        return header
+
+    @staticmethod
+    def _last_header_end(file, encryption_key) -> Optional[int]:
+        # offset just past the last Footer whose header authenticates and whose tables are intact, found by
+        # searching backwards from the end; whatever follows it is an append that never completed. None if
+        # there is no such header. "CRF_END" can also occur inside a token, the MAC rules those out
+        keys = CreditReportReader._keys(encryption_key)
+        position = file.seek(0, 2)
+        while position > 0:
+            start = max(0, position - RECOVERY_CHUNK)
+            file.seek(start)
+            chunk = file.read(position - start + len(Footer) - 1) # overlaps the next chunk so no Footer is split
+            found = chunk.rfind(Footer)
+            while found >= 0:
+                end = start + found + len(Footer)
+                if CreditReportReader._intact_trailer(file, keys, end):
+                    return end
+                found = chunk.rfind(Footer, 0, found + len(Footer) - 1)
+            position = start
+        return None
+
+    @staticmethod
+    def _intact_trailer(file, keys: list, end: int) -> bool:
+        if end < len(Magic_Number) + 2 + HEADER.size + MAC_SIZE + len(Footer):
+            return False
+        file.seek(end - len(Footer) - MAC_SIZE - HEADER.size)
+        header_data = file.read(HEADER.size)
+        mac = file.read(MAC_SIZE)
+        if not any(hmac.compare_digest(mac, hmac.new(CreditReportReader._mac_key(key), header_data, hashlib.sha256).digest())
+                   for key in keys):
+            return False
+        magic, _, _, _, _, tables_offset, tables_length, digest = HEADER.unpack(header_data)
+        file.seek(tables_offset)
+        return magic == Magic_Number and hashlib.sha256(file.read(tables_length)).digest() == digest
+
+    @staticmethod
+    def read_metadata(filename: str, encryption_key: bytes, stats: CRFStats = None) -> FileMetaData:
+        started = perf_counter() if stats is not None else 0
+        with open(filename, "rb") as file:
+            if file.read(len(Magic_Number)) == Magic_Number:
+                header = CreditReportReader._read_header(file, encryption_key, tables = False) # one small read + MAC check
+                if stats is not None:
+                    stats.add("header", perf_counter() - started, HEADER.size + MAC_SIZE)
+                return FileMetaData(version = header.version, record_count = header.record_count)
+            decrypted_data = CreditReportReader._read_legacy(file, encryption_key, stats)
+
         f = io.BytesIO(decrypted_data)
 
         if f.read(3) != Magic_Number:
@@ -118,4 +789,311 @@ class CreditReportReader:
         version = struct.unpack("<H", f.read(2))[0]
         record_count = struct.unpack("<I", f.read(4))[0]
 
-        return FileMetaData(version = version, record_count = record_count)
\ No newline at end of file
+        return FileMetaData(version = version, record_count = record_count)
+
+    @staticmethod
+    def read_index(buffer) -> Dict[str, tuple]:
+        index = {}
+        entry_count = U32.unpack_from(buffer, 0)[0]
+        position = 4
+        for _ in range(entry_count):
+            length = U32.unpack_from(buffer, position)[0]
+            position += 4
+            sin_hash = buffer[position:position + length].decode("utf-8")
+            position += length
+            index[sin_hash] = INDEX_LOCATION.unpack_from(buffer, position) # segment number, offset inside the segment
+            position += INDEX_LOCATION.size
+        return index
+
+    @staticmethod
+    def find_by_sin(filename: str, sin: str, encryption_key: bytes, stats: CRFStats = None) -> Optional[CreditRecord]:
+        return CreditReportReader.find_by_sins(filename, [sin], encryption_key, stats).get(sin)
+
+    @staticmethod
+    def find_by_sins(filename: str, sins: Iterable[str], encryption_key: bytes, stats: CRFStats = None) -> Dict[str, CreditRecord]:
+        wanted = {hashlib.sha256(sin.encode()).hexdigest(): sin for sin in sins} # records are keyed by hashed SIN
+        fernet = CreditReportReader._fernet(encryption_key)
+
+        with open(filename, "rb") as file:
+            if file.read(len(Magic_Number)) != Magic_Number:
+                return CreditReportReader._find_legacy(CreditReportReader._read_legacy(file, encryption_key), wanted)
+
+            started = perf_counter() if stats is not None else 0
+            header = CreditReportReader._read_header(file, encryption_key)
+            parsed = perf_counter() if stats is not None else 0
+            located = CreditReportReader._locate(file, header, fernet, wanted)
+            if stats is not None:
+                stats.add("header", parsed - started, sum(len(data) for data in header.sections.values()))
+                stats.add("index", perf_counter() - parsed)
+            records = CreditReportReader._read_located(file, header, fernet, located, stats)
+        return {wanted[sin_hash]: record for sin_hash, record in records.items()}
+
+    @staticmethod
+    def _read_located(file, header: FileHeader, fernet: Fernet, located: Dict[str, tuple],
+                      stats: CRFStats = None) -> Dict[str, CreditRecord]:
+        # decodes the records at the given hashed SIN → (segment, offset) locations
+        by_segment: Dict[int, List[tuple]] = {}
+        for sin_hash, (segment, record_offset) in located.items():
+            by_segment.setdefault(segment, []).append((record_offset, sin_hash))
+
+        found = {}
+        dictionary = CreditReportReader._read_dictionary(file, fernet, header) if by_segment else None
+        for segment, hits in by_segment.items(): # only segments that hold a match are decrypted
+            buffer = CreditReportReader._read_block(file, fernet, header, header.segments[segment], stats)
+            started = perf_counter() if stats is not None else 0
+            for record_offset, sin_hash in hits:
+                found[sin_hash] = CreditReportReader.decode_record(buffer, record_offset, dictionary)[0]
+            if stats is not None:
+                stats.add("decode", perf_counter() - started)
+                stats.records += len(hits)
+        return found
+
+    @staticmethod
+    def find_by_score(filename: str, min_score: Optional[int], max_score: Optional[int], encryption_key: bytes) -> List[CreditRecord]:
+        # records with min_score <= credit_score <= max_score (None leaves that side open), in file order
+        low = 0 if min_score is None else min_score
+        high = 0xFFFFFFFF if max_score is None else max_score
+
+        def select(payload: bytes) -> List[int]:
+            count = U32.unpack_from(payload, 0)[0]
+            scores = CreditReportReader._u32_array(payload[4:4 + count * 4])
+            ordinals = CreditReportReader._u32_array(payload[4 + count * 4:4 + count * 8])
+            return sorted(ordinals[bisect_left(scores, low):bisect_right(scores, high)]) # scores are stored sorted
+
+        return CreditReportReader._find_indexed(filename, encryption_key, "score_index", select,
+                                                lambda record: low <= record.credit_score <= high)
+
+    @staticmethod
+    def find_by_flags(filename: str, major_flags, encryption_key: bytes) -> List[CreditRecord]:
+        # records whose major_flags equals the given value, or any of the given values, in file order
+        values = {major_flags} if isinstance(major_flags, int) else set(major_flags)
+
+        def select(payload: bytes) -> List[int]:
+            matches = 0
+            position = 4
+            for _ in range(U32.unpack_from(payload, 0)[0]):
+                value, length = INDEX_LOCATION.unpack_from(payload, position)
+                position += INDEX_LOCATION.size
+                if value in values: # OR the bitmaps of every requested value
+                    matches |= int.from_bytes(payload[position:position + length], "little")
+                position += length
+            ordinals = []
+            for byte_index, byte in enumerate(matches.to_bytes((matches.bit_length() + 7) // 8, "little")):
+                if byte:
+                    ordinals.extend(byte_index * 8 + bit for bit in range(8) if byte >> bit & 1)
+            return ordinals
+
+        return CreditReportReader._find_indexed(filename, encryption_key, "flag_index", select,
+                                                lambda record: record.major_flags in values)
+
+    @staticmethod
+    def _find_indexed(filename: str, encryption_key: bytes, index_name: str, select, matches) -> List[CreditRecord]:
+        # decrypts a secondary index, turns it into sorted base record ordinals with select(), then decrypts only
+        # the base segments holding a match and decodes only the matching records. Secondary indexes cover the
+        # base file, so delta segments (small by design) are decoded in full and filtered with matches()
+        fernet = CreditReportReader._fernet(encryption_key)
+        with open(filename, "rb") as file:
+            if file.read(len(Magic_Number)) != Magic_Number:
+                raise ValueError("Secondary indexes require a v3 file.")
+            header = CreditReportReader._read_header(file, encryption_key)
+            index = getattr(header, index_name)
+            if index is None:
+                raise ValueError("File has no secondary indexes; write it with secondary_indexes=True.")
+            ordinals = select(CreditReportReader._read_block(file, fernet, header, index))
+            dropped = CreditReportReader._superseded(file, header, fernet)
+            dictionary = CreditReportReader._read_dictionary(file, fernet, header)
+
+            base_segments = header.deltas[0][0] if header.deltas else len(header.segments)
+            starts = [] # ordinal of the first record in each base segment
+            total = 0
+            for _, _, segment_records, _ in header.segments[:base_segments]:
+                starts.append(total)
+                total += segment_records
+
+            by_segment: Dict[int, List[int]] = {}
+            for ordinal in ordinals:
+                segment = bisect_right(starts, ordinal) - 1
+                by_segment.setdefault(segment, []).append(ordinal - starts[segment])
+
+            records = []
+            for segment, hits in by_segment.items(): # ordinals are sorted, so segments come in file order
+                buffer = CreditReportReader._read_block(file, fernet, header, header.segments[segment])
+                segment_dropped = dropped.get(segment)
+                position = 0
+                current = 0
+                for hit in hits: # everything between two hits is skipped by length prefix, not decoded
+                    while current < hit:
+                        position = CreditReportReader._skip_record(buffer, position)
+                        current += 1
+                    if not (segment_dropped and position in segment_dropped):
+                        records.append(CreditReportReader.decode_record(buffer, position, dictionary)[0])
+
+            for segment in range(base_segments, len(header.segments)):
+                segment_records = header.segments[segment][2]
+                buffer = CreditReportReader._read_block(file, fernet, header, header.segments[segment])
+                segment_dropped = dropped.get(segment)
+                position = 0
+                for _ in range(segment_records):
+                    start = position
+                    record, position = CreditReportReader.decode_record(buffer, position, dictionary)
+                    if matches(record) and not (segment_dropped and start in segment_dropped):
+                        records.append(record)
+        return records
+
+    @staticmethod
+    def _read_dictionary(file, fernet: Fernet, header: FileHeader) -> Optional[List[str]]:
+        # account names in code order; interned, so every record shares one str per distinct name
+        if header.dictionary is None:
+            return None
+        cache = CreditReportReader.cache if header.cache_key is not None else None
+        if cache is not None:
+            dictionary = cache.get((header.cache_key, "dictionary"))
+            if dictionary is not None:
+                return dictionary
+        buffer = CreditReportReader._open_block(fernet, CreditReportReader._read_token(file, header.dictionary), header.flags)
+        dictionary = []
+        position = 4
+        for _ in range(U32.unpack_from(buffer, 0)[0]):
+            length = U32.unpack_from(buffer, position)[0]
+            dictionary.append(sys.intern(buffer[position + 4:position + 4 + length].decode("utf-8")))
+            position += 4 + length
+        if cache is not None:
+            cache.put((header.cache_key, "dictionary"), dictionary, len(buffer) + len(dictionary) * DICTIONARY_ENTRY_COST)
+        return dictionary
+
+    @staticmethod
+    def _u32_array(data: bytes) -> array:
+        values = array("I", data)
+        if sys.byteorder != "little": # arrays are native-endian, the file format is little-endian
+            values.byteswap()
+        return values
+
+    @staticmethod
+    def might_contain(filename: str, sin: str, encryption_key: bytes) -> bool:
+        # tests the Bloom filter in the authenticated header, nothing is decrypted: False means the SIN is
+        # definitely not in the file. Files without a filter (v1/v2, or not written with bloom_filter=True)
+        # always answer True
+        with open(filename, "rb") as file:
+            if file.read(len(Magic_Number)) != Magic_Number:
+                return True
+            header = CreditReportReader._read_header(file, encryption_key)
+        bloom = header.sections.get(b"BLOM")
+        if bloom is None:
+            return True
+        sin_hash = hashlib.sha256(sin.encode()).hexdigest()
+        return any(CreditReportReader._bloom_contains(bloom, key, sin_hash) for key in CreditReportReader._keys(encryption_key))
+
+    @staticmethod
+    def find_in_files(files: Iterable[Tuple[str, bytes]], sin: str) -> Dict[str, CreditRecord]:
+        # looks a SIN up across (filename, key) pairs; only files whose Bloom filter may hold it are opened
+        found = {}
+        for filename, encryption_key in files:
+            if CreditReportReader.might_contain(filename, sin, encryption_key):
+                record = CreditReportReader.find_by_sin(filename, sin, encryption_key)
+                if record is not None:
+                    found[filename] = record
+        return found
+
+    @staticmethod
+    def _bloom_contains(bloom: bytes, encryption_key: bytes, sin_hash: str) -> bool:
+        bloom_key = CreditReportReader._bloom_key(encryption_key)
+        hash_count = U32.unpack_from(bloom, 0)[0]
+        size = (len(bloom) - 4) * 8
+        first, step = BLOOM_PROBE.unpack(hashlib.blake2b(sin_hash.encode(), key=bloom_key, digest_size=16).digest())
+        for i in range(hash_count):
+            position = (first + i * step) % size
+            if not bloom[4 + (position >> 3)] >> (position & 7) & 1:
+                return False
+        return True
+
+    @staticmethod
+    def _index_bucket(sin_hash: str, bucket_count: int) -> int:
+        return int(sin_hash[:8], 16) % bucket_count # same hash-prefix bucketing as the writer
+
+    @staticmethod
+    def _read_bucket(file, fernet: Fernet, header: FileHeader, bucket: tuple) -> Dict[str, tuple]:
+        # parsed once per cache entry rather than cached as a buffer, lookups then skip decoding the bucket too
+        cache = CreditReportReader.cache if header.cache_key is not None else None
+        if cache is not None:
+            index = cache.get((header.cache_key, "index", bucket[0]))
+            if index is not None:
+                return index
+        token = CreditReportReader._read_token(file, bucket)
+        index = CreditReportReader.read_index(CreditReportReader._open_block(fernet, token, header.flags))
+        if cache is not None:
+            cache.put((header.cache_key, "index", bucket[0]), index, len(index) * INDEX_ENTRY_COST)
+        return index
+
+    @staticmethod
+    def _locate_in(file, fernet: Fernet, header: FileHeader, buckets: List[tuple], hashes: Iterable[str]) -> Dict[str, tuple]:
+        by_bucket: Dict[int, List[str]] = {} # group lookups so each bucket is decrypted once
+        for sin_hash in hashes:
+            by_bucket.setdefault(CreditReportReader._index_bucket(sin_hash, len(buckets)), []).append(sin_hash)
+
+        found = {}
+        for bucket, group in by_bucket.items():
+            index = CreditReportReader._read_bucket(file, fernet, header, buckets[bucket])
+            for sin_hash in group:
+                if sin_hash in index:
+                    found[sin_hash] = index[sin_hash]
+        return found
+
+    @staticmethod
+    def _locate(file, header: FileHeader, fernet: Fernet, hashes: Iterable[str]) -> Dict[str, tuple]:
+        # hashed SIN → (segment, offset) of its live record; newest delta first, so the last writer wins
+        remaining = set(hashes)
+        found = {}
+        for _, _, buckets in reversed(header.deltas):
+            if not remaining:
+                break
+            found.update(CreditReportReader._locate_in(file, fernet, header, buckets, remaining))
+            remaining -= found.keys()
+        if remaining:
+            found.update(CreditReportReader._locate_in(file, fernet, header, header.buckets, remaining))
+        return found
+
+    @staticmethod
+    def _live_index(file, header: FileHeader, fernet: Fernet) -> Dict[str, tuple]:
+        # every hashed SIN → (segment, offset) of its live record: base buckets, then each delta in order
+        index = {}
+        for bucket in header.buckets:
+            index.update(CreditReportReader._read_bucket(file, fernet, header, bucket))
+        for _, _, buckets in header.deltas:
+            for bucket in buckets:
+                index.update(CreditReportReader._read_bucket(file, fernet, header, bucket))
+        return index
+
+    @staticmethod
+    def _superseded(file, header: FileHeader, fernet: Fernet) -> Dict[int, set]:
+        # segment → offsets of records that a newer delta rewrote; delta indexes are small, so they are read
+        # in full, and only the base buckets holding rewritten SINs are decrypted
+        dropped: Dict[int, set] = {}
+        if not header.deltas:
+            return dropped
+
+        latest = set()
+        for _, _, buckets in reversed(header.deltas):
+            for bucket in buckets:
+                for sin_hash, (segment, offset) in CreditReportReader._read_bucket(file, fernet, header, bucket).items():
+                    if sin_hash in latest:
+                        dropped.setdefault(segment, set()).add(offset)
+                    else:
+                        latest.add(sin_hash)
+        for segment, offset in CreditReportReader._locate_in(file, fernet, header, header.buckets, latest).values():
+            dropped.setdefault(segment, set()).add(offset)
+        return dropped
+
+    @staticmethod
+    def _find_legacy(decrypted_data: bytes, wanted: Dict[str, str]) -> Dict[str, CreditRecord]:
+        records_start, _, index_start = CreditReportReader._parse_legacy(decrypted_data)
+
+        found = {}
+        f = io.BytesIO(decrypted_data)
+        f.seek(index_start)
+        entry_count = struct.unpack("<I", f.read(4))[0]
+        for _ in range(entry_count):
+            sin_hash = CreditReportReader.read_string(f)
+            offset = struct.unpack("<I", f.read(4))[0]
+            if sin_hash in wanted: # v2 offsets are relative to the start of the records
+                found[wanted[sin_hash]] = CreditReportReader.decode_record(decrypted_data, records_start + offset)[0]
+        return found
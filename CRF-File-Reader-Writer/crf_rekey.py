@@ -0,0 +1,153 @@
+from dataclasses import dataclass
+from typing import Iterable, List, Optional
+
+from concurrent.futures import ProcessPoolExecutor
+from cryptography.fernet import Fernet, InvalidToken, MultiFernet
+import glob
+import hashlib
+import os
+import shutil
+
+from crf_dataset import MANIFEST_NAME, CreditReportDataset
+from crf_delta import CreditReportDelta
+from crf_reader import CreditReportReader, FileHeader, Footer, HEADER, MAC_SIZE, Magic_Number, U32
+from crf_writer import BUCKET_ENTRY, DELTA_ENTRY, CreditReportWriter
+
+# Re-keying works on Fernet tokens only: each token is decrypted with an old key and re-encrypted
+# with the new one. Records are never parsed, SINs are never re-hashed, and since a token's size only
+# depends on its plaintext size, every offset in the header tables stays valid. The tables are rewritten
+# in place with the new token digests and the keyed Bloom filter, then the header gets the new MAC.
+# Files with deltas are compacted under the new key instead: superseded records, old headers and
+# replaced dictionaries are dead bytes no table points at, and would stay readable with the old key.
+# A dataset directory is rotated shard by shard, then its manifest is rebuilt under the new key.
+
+@dataclass
+class RekeyResult: # outcome of one file in rekey_directory, error is set instead of raising
+    filename: str
+    error: Optional[Exception] = None
+
+class CreditReportRekeyer:
+    @staticmethod
+    def rekey_file(filename: str, old_keys, new_key: bytes, output: str = None):
+        # old_keys is one key or a list; output defaults to replacing the file in place
+        output = output or filename
+        old_keys = old_keys if isinstance(old_keys, (list, tuple)) else [old_keys]
+        rotator = MultiFernet([Fernet(new_key)] + [Fernet(key) for key in old_keys])
+        temp_file = output + ".rekey.tmp" # same directory, so os.replace below is atomic
+
+        with open(filename, "rb") as file:
+            segmented = file.read(len(Magic_Number)) == Magic_Number
+
+        if segmented:
+            header = CreditReportReader.read_header(filename, old_keys) # checks the old MAC first
+            if header.deltas:
+                CreditReportDelta.compact(filename, old_keys, output, new_key=new_key)
+                return
+
+        try:
+            if segmented:
+                shutil.copyfile(filename, temp_file)
+                with open(temp_file, "r+b") as f:
+                    bloom = None
+                    if b"BLOM" in header.sections:
+                        bloom = CreditReportRekeyer._rebuild_bloom(f, header, old_keys, new_key)
+                    digests = {}
+                    for block in CreditReportReader.encrypted_blocks(header): # one token in memory at a time
+                        token = CreditReportRekeyer._rotate(rotator, CreditReportReader._read_token(f, block))
+                        if len(token) != block[1]:
+                            raise ValueError("Re-encrypted token changed size.")
+                        f.seek(block[0])
+                        f.write(token)
+                        digests[block[0]] = hashlib.sha256(token).digest()
+                    CreditReportRekeyer._rewrite_tables(f, header, new_key, digests, bloom)
+            else:
+                with open(filename, "rb") as file: # v1/v2 files are one whole-file token
+                    token = CreditReportRekeyer._rotate(rotator, file.read())
+                with open(temp_file, "wb") as f:
+                    f.write(token)
+            os.replace(temp_file, output)
+        except BaseException:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+            raise
+
+    @staticmethod
+    def rekey_directory(directory: str, old_keys, new_key: bytes, workers: int = None,
+                        pattern: str = "*.crf") -> List[RekeyResult]:
+        if os.path.exists(os.path.join(directory, MANIFEST_NAME)): # a dataset, its manifest has to follow the shards
+            return CreditReportRekeyer.rekey_dataset(directory, old_keys, new_key, workers)
+        filenames = sorted(glob.glob(os.path.join(directory, pattern)))
+        return CreditReportRekeyer.rekey_files(filenames, old_keys, new_key, workers)
+
+    @staticmethod
+    def rekey_dataset(directory: str, old_keys, new_key: bytes, workers: int = None) -> List[RekeyResult]:
+        # rotates every shard, then rebuilds the manifest under new_key. Re-encrypting the manifest alone would
+        # not do: rotation changes every shard's mtime, and shards with deltas are compacted, which moves records
+        old_keys = old_keys if isinstance(old_keys, (list, tuple)) else [old_keys]
+        filenames = [os.path.join(directory, name) for name in sorted(os.listdir(directory)) if name.endswith(".crf")]
+        results = CreditReportRekeyer.rekey_files(filenames, old_keys, new_key, workers)
+        CreditReportDataset(directory, [new_key] + list(old_keys)).refresh() # shards that failed still hold an old key
+        return results
+
+    @staticmethod
+    def rekey_files(filenames: Iterable[str], old_keys, new_key: bytes, workers: int = None) -> List[RekeyResult]:
+        results = []
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            jobs = [(filename, pool.submit(CreditReportRekeyer.rekey_file, filename, old_keys, new_key))
+                    for filename in filenames]
+            for filename, future in jobs:
+                try:
+                    future.result()
+                    results.append(RekeyResult(filename))
+                except Exception as e: # a bad key or corrupted file is reported, the rest keep going
+                    results.append(RekeyResult(filename, e))
+        return results
+
+    @staticmethod
+    def _rebuild_bloom(f, header: FileHeader, old_keys, new_key: bytes) -> bytes:
+        # the filter is keyed, so it is recomputed from the index buckets (read before they are rotated); it keeps its size
+        fernet = CreditReportReader._fernet(old_keys)
+        hashes = []
+        for bucket in header.buckets + [bucket for _, _, buckets in header.deltas for bucket in buckets]:
+            hashes += CreditReportReader._read_bucket(f, fernet, header, bucket)
+        bloom = header.sections[b"BLOM"]
+        bits = bytearray(len(bloom) - 4)
+        CreditReportWriter._bloom_add(bits, new_key, hashes, U32.unpack_from(bloom, 0)[0])
+        return bloom[:4] + bytes(bits)
+
+    @staticmethod
+    def _rewrite_tables(f, header: FileHeader, new_key: bytes, digests: dict, bloom: bytes = None):
+        # same tables with the rotated tokens' digests (and filter); entries keep their sizes, so the tables and
+        # header are written over the old ones at the same offset
+        def restamp(block: tuple) -> tuple:
+            return (*block[:-1], digests[block[0]])
+
+        sections = {}
+        for tag, data in header.sections.items():
+            if tag == b"SEGS": # written by _write_header from the segment list
+                continue
+            if tag == b"IDXB":
+                data = b"".join(BUCKET_ENTRY.pack(*restamp(bucket)) for bucket in header.buckets)
+            elif tag == b"DELT":
+                data = b"".join(DELTA_ENTRY.pack(first_segment, segment_count, len(buckets))
+                                + b"".join(BUCKET_ENTRY.pack(*restamp(bucket)) for bucket in buckets)
+                                for first_segment, segment_count, buckets in header.deltas)
+            elif tag in (b"SCOR", b"FLAG", b"DICT"):
+                data = BUCKET_ENTRY.pack(*restamp(BUCKET_ENTRY.unpack(data)))
+            elif tag == b"BLOM" and bloom is not None:
+                data = bloom
+            sections[tag] = data
+
+        f.seek(-HEADER.size - MAC_SIZE - len(Footer), 2)
+        tables_offset = HEADER.unpack(f.read(HEADER.size))[5]
+        f.seek(tables_offset)
+        f.truncate()
+        CreditReportWriter._write_header(f, new_key, header.flags, header.record_count,
+                                         [restamp(segment) for segment in header.segments], sections)
+
+    @staticmethod
+    def _rotate(rotator: MultiFernet, token: bytes) -> bytes:
+        try:
+            return rotator.rotate(token)
+        except InvalidToken as e:
+            raise ValueError(f"Decryption failed. Invalid key or corrupted file: {e}")
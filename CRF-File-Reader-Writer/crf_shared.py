@@ -0,0 +1,169 @@
+from typing import Dict, Iterable, Optional
+
+from multiprocessing import resource_tracker, shared_memory
+import hashlib
+import struct
+import sys
+
+from crf_reader import CreditReportReader, CreditRecord
+from crf_writer import CreditReportWriter
+
+# One process decrypts a CRF file into a shared memory block; every other process attaches to the
+# same block by name and decodes records straight out of it, so N workers hold one plaintext copy.
+#
+# Block layout:
+#   SHM_HEADER  magic, record count, block count, index offset, index entry count
+#   block table block count × (offset, length, record count), one block per decrypted segment
+#   records     decrypted segment payloads, back to back
+#   index       sorted (SHA-256 digest, record offset, record length) entries, binary searched in place
+
+SHM_MAGIC = b"CRFSHM01"
+SHM_HEADER = struct.Struct("<8sIIQQ")
+SHM_BLOCK = struct.Struct("<QQI")
+SHM_INDEX_ENTRY = struct.Struct("<32sQI")
+U32 = struct.Struct("<I")
+
+# The block lives until the owner calls unlink(), not until some process exits. Python 3.13+ can skip
+# the resource tracker with track=False; older versions register every open, so those registrations
+# are undone by hand (a tracker shared between owner and workers would otherwise unlink it early).
+TRACK_FLAG = sys.version_info >= (3, 13)
+
+class SharedCreditReport:
+    def __init__(self, shm: shared_memory.SharedMemory, owner: bool):
+        self._shm = shm
+        self.owner = owner
+        self.name = shm.name
+        magic, self.record_count, block_count, self._index_offset, self._index_count = SHM_HEADER.unpack_from(shm.buf, 0)
+        if magic != SHM_MAGIC:
+            raise ValueError("Not a shared CRF block.")
+        self._blocks = [SHM_BLOCK.unpack_from(shm.buf, SHM_HEADER.size + i * SHM_BLOCK.size) for i in range(block_count)]
+
+    @staticmethod
+    def load(filename: str, encryption_key: bytes, name: str = None) -> "SharedCreditReport":
+        # decrypts once; blocks are copied into shared memory and dropped, so the peak is about two copies
+        blocks = []
+        index: Dict[bytes, tuple] = {}
+        records_size = 0
+        for buffer, position, record_count, dropped, dictionary in CreditReportReader._iter_blocks(filename, encryption_key):
+            start = position
+            rewrite = dropped or dictionary # copy record by record instead of slicing the whole block
+            kept = bytearray() # only used when a newer delta superseded some records or names are dictionary-coded
+            live = 0
+            for _ in range(record_count): # only the SIN is decoded, the rest is skipped by length prefix
+                record_start = position
+                length = U32.unpack_from(buffer, position)[0]
+                sin_hash = buffer[position + 4:position + 4 + length]
+                position = CreditReportReader._skip_record(buffer, position)
+                if rewrite:
+                    if dropped and record_start in dropped:
+                        continue
+                    record_offset = len(kept)
+                    if dictionary: # shared blocks hold plain records, so attached processes need no dictionary
+                        record = CreditReportReader.decode_record(buffer, record_start, dictionary)[0]
+                        kept += CreditReportWriter.encode_record(record, record.sin)
+                    else:
+                        kept += buffer[record_start:position]
+                    record_length = len(kept) - record_offset
+                else:
+                    record_offset = record_start - start
+                    record_length = position - record_start
+                index[bytes.fromhex(sin_hash.decode("ascii"))] = (records_size + record_offset, record_length)
+                live += 1
+            block = bytes(kept) if rewrite else buffer[start:position]
+            blocks.append((block, live))
+            records_size += len(block)
+
+        table_size = SHM_HEADER.size + len(blocks) * SHM_BLOCK.size
+        index_offset = table_size + records_size
+        shm = SharedCreditReport._open_shm(name, create = True, size = max(1, index_offset + len(index) * SHM_INDEX_ENTRY.size))
+        try:
+            buf = shm.buf
+            SHM_HEADER.pack_into(buf, 0, SHM_MAGIC, sum(count for _, count in blocks), len(blocks), index_offset, len(index))
+            offset = table_size
+            for i, (data, record_count) in enumerate(blocks):
+                SHM_BLOCK.pack_into(buf, SHM_HEADER.size + i * SHM_BLOCK.size, offset, len(data), record_count)
+                buf[offset:offset + len(data)] = data
+                offset += len(data)
+                blocks[i] = None # release each decrypted block once it is in shared memory
+
+            position = index_offset
+            for digest in sorted(index):
+                record_offset, record_length = index[digest]
+                SHM_INDEX_ENTRY.pack_into(buf, position, digest, table_size + record_offset, record_length)
+                position += SHM_INDEX_ENTRY.size
+            del buf
+        except BaseException:
+            shm.close()
+            SharedCreditReport._unlink_shm(shm)
+            raise
+        return SharedCreditReport(shm, owner = True)
+
+    @staticmethod
+    def attach(name: str) -> "SharedCreditReport":
+        return SharedCreditReport(SharedCreditReport._open_shm(name), owner = False)
+
+    @staticmethod
+    def _open_shm(name: str, create: bool = False, size: int = 0) -> shared_memory.SharedMemory:
+        if TRACK_FLAG:
+            return shared_memory.SharedMemory(name=name, create=create, size=size, track=False)
+        shm = shared_memory.SharedMemory(name=name, create=create, size=size)
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+    @staticmethod
+    def _unlink_shm(shm: shared_memory.SharedMemory):
+        if not TRACK_FLAG:
+            resource_tracker.register(shm._name, "shared_memory") # SharedMemory.unlink unregisters it again
+        shm.unlink()
+
+    def _find_entry(self, digest: bytes) -> Optional[tuple]:
+        buf = self._shm.buf
+        low, high = 0, self._index_count
+        while low < high: # binary search over the sorted index, directly in shared memory
+            middle = (low + high) // 2
+            entry_digest, record_offset, record_length = SHM_INDEX_ENTRY.unpack_from(
+                buf, self._index_offset + middle * SHM_INDEX_ENTRY.size)
+            if entry_digest == digest:
+                return record_offset, record_length
+            if entry_digest < digest:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    def find_by_sin(self, sin: str) -> Optional[CreditRecord]:
+        entry = self._find_entry(hashlib.sha256(sin.encode()).digest())
+        if entry is None:
+            return None
+        record_offset, record_length = entry
+        return CreditReportReader.decode_record(bytes(self._shm.buf[record_offset:record_offset + record_length]))[0]
+
+    def find_by_sins(self, sins: Iterable[str]) -> Dict[str, CreditRecord]:
+        found = {}
+        for sin in sins:
+            record = self.find_by_sin(sin)
+            if record is not None:
+                found[sin] = record
+        return found
+
+    def iter_records(self):
+        for offset, length, record_count in self._blocks: # copies out one segment at a time
+            buffer = bytes(self._shm.buf[offset:offset + length])
+            position = 0
+            for _ in range(record_count):
+                record, position = CreditReportReader.decode_record(buffer, position)
+                yield record
+
+    def close(self):
+        self._shm.close()
+
+    def unlink(self):
+        if self.owner:
+            SharedCreditReport._unlink_shm(self._shm)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        self.unlink()
@@ -0,0 +1,48 @@
+from dataclasses import asdict, dataclass
+from typing import Callable, Dict
+
+# Optional instrumentation for reader and writer calls. Pass a CRFStats as stats= and each phase
+# (file I/O, header and index parsing, decryption, decompression, record decoding; on the write side
+# SIN hashing, encoding, compression, encryption, writing) adds its wall time and byte count to it.
+# Without one, the read and write loops only pay an `is None` check per segment.
+#
+# Phases do not overlap, so their seconds add up to roughly the time of the call. A callback, when
+# given, is called with (phase, seconds, bytes) for every measurement, e.g. to feed a metrics exporter.
+
+@dataclass
+class PhaseStats:
+    seconds: float = 0.0
+    bytes: int = 0
+    calls: int = 0
+    max_bytes: int = 0 # largest single buffer handled in this phase
+
+class CRFStats:
+    def __init__(self, callback: Callable[[str, float, int], None] = None):
+        self.phases: Dict[str, PhaseStats] = {}
+        self.records = 0
+        self.callback = callback
+
+    def add(self, phase: str, seconds: float, nbytes: int = 0):
+        stats = self.phases.get(phase)
+        if stats is None:
+            stats = self.phases[phase] = PhaseStats()
+        stats.seconds += seconds
+        stats.bytes += nbytes
+        stats.calls += 1
+        if nbytes > stats.max_bytes:
+            stats.max_bytes = nbytes
+        if self.callback is not None:
+            self.callback(phase, seconds, nbytes)
+
+    @property
+    def seconds(self) -> float:
+        return sum(stats.seconds for stats in self.phases.values())
+
+    def as_dict(self) -> dict:
+        return {"records": self.records, "phases": {phase: asdict(stats) for phase, stats in self.phases.items()}}
+
+    def __str__(self):
+        lines = [f"{self.records:,} records, {self.seconds:.3f} s"]
+        for phase, stats in sorted(self.phases.items(), key=lambda item: -item[1].seconds):
+            lines.append(f"  {phase:<11} {stats.seconds:8.3f} s {stats.bytes / 1e6:10.1f} MB {stats.calls:8,} calls")
+        return "\n".join(lines)
@@ -1,15 +1,60 @@
 from dataclasses import dataclass  # for easy structuring https://docs.python.org/3/library/dataclasses.html
-from typing import List, Dict       # imported for readability https://docs.python.org/3/library/typing.html
+from typing import List, Dict, Iterable, Iterator  # imported for readability https://docs.python.org/3/library/typing.html
 import struct                      # transition from plain-text to binary
+import base64
 import hashlib
+import hmac
+import lzma
 import zlib
 from cryptography.fernet import Fernet  # fernet encryption taken from https://cryptography.io/en/latest/fernet/
 import io
+import os
+import sys
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+
+from crf_stats import CRFStats
+
+try:
+    import zstandard  # optional, only needed for compression="zstd"
+except ImportError:
+    zstandard = None
 
 Magic_Number = b"CRF"   # file identifier to recognize CRF files
-VERSION = 2            # version number for compatibility checks
+VERSION = 3            # version number for compatibility checks
+LEGACY_VERSION = 2     # last whole-file Fernet layout, still writable for older readers
 Footer = b"CRF_END"    # footer marker to indicate the end of the file
 
+SEGMENT_SIZE = 4 * 1024 * 1024       # plaintext bytes per independently encrypted v3 segment
+SEGMENT_ENTRY = struct.Struct("<QII32s")  # segment file offset, token length, record count, SHA-256 of the token
+BUCKET_ENTRY = struct.Struct("<QI32s")    # index bucket file offset, token length, SHA-256 of the token
+DELTA_ENTRY = struct.Struct("<III")    # delta first segment, segment count, bucket count; bucket entries follow
+HEADER = struct.Struct("<3sHHIIQI32s") # magic, version, flags, record count, segment count, tables offset/length/digest
+SECTION = struct.Struct("<4sI")        # tag + length of each block in the header tables
+
+# precompiled record codec, avoids re-parsing a format string for every field
+U32 = struct.Struct("<I")
+FIXED_FIELDS = struct.Struct("<III")   # credit_score, account_count, major_flags in one pack
+BALANCE = struct.Struct("<i")          # account balance as 4-byte signed integer
+INDEX_LOCATION = struct.Struct("<II")  # segment number + offset inside that segment
+INDEX_BUCKET_SIZE = 4096               # target index entries per encrypted bucket, keeps point lookups O(1)
+ENCODE_BATCH = 2048                    # records per encoding task when writing with workers > 1
+DICTIONARY_CODE = 0x80000000           # set in an account name's length prefix: the rest is a dictionary code
+DICTIONARY_LIMIT = 65536               # names past this many distinct values are written inline
+BLOOM_BITS_PER_SIN = 10                # Bloom filter size; with 4 probes about 1% false positives
+BLOOM_HASHES = 4
+BLOOM_PROBE = struct.Struct("<QQ")     # two 64-bit hashes, combined into BLOOM_HASHES bit positions
+
+# compression codec ids, stored in the low bits of the header flags and applied before encryption
+COMPRESSION_NONE = 0
+COMPRESSION_ZLIB = 1
+COMPRESSION_LZMA = 2
+COMPRESSION_ZSTD = 3
+COMPRESSION_CODECS = {None: COMPRESSION_NONE, "zlib": COMPRESSION_ZLIB, "lzma": COMPRESSION_LZMA, "zstd": COMPRESSION_ZSTD}
+FLAG_COMPRESSION_MASK = 0x000F
+
 @dataclass
 class Account:  # Type of account + Balance of that account
     name: str
@@ -34,36 +79,240 @@ class CreditReportWriter:
     @staticmethod
     def write_string(f, s: str):
         encoded = s.encode("utf-8")  # converts string to bytes
-        f.write(struct.pack("<I", len(encoded)))  # converts length into 4-byte unsigned int & records length
+        f.write(U32.pack(len(encoded)))  # converts length into 4-byte unsigned int & records length
         f.write(encoded)  # writes UTF-8 encoded string
 
     @staticmethod
     def write_record(f, record: CreditRecord, hashed_sin: str = None) -> int:
-        start_pos = f.tell()  # determines starting position in the buffer
-        
+        data = CreditReportWriter.encode_record(record, hashed_sin)
+        f.write(data)
+        return len(data)  # returns total size of the record
+
+    @staticmethod
+    def encode_record(record: CreditRecord, hashed_sin: str = None, dictionary: Dict[str, int] = None) -> bytes:
+        # with a dictionary, account names are written as codes into it, and new names are added as they appear
         if hashed_sin is None:
             # converts SIN into bytes, hashes with SHA-256, then converts to hexadecimal string
             hashed_sin = hashlib.sha256(record.sin.encode()).hexdigest()
-        CreditReportWriter.write_string(f, hashed_sin)
-        CreditReportWriter.write_string(f, record.name)
-        CreditReportWriter.write_string(f, record.address)
-        f.write(struct.pack("<I", record.credit_score))
-        f.write(struct.pack("<I", record.account_count))
-        f.write(struct.pack("<I", record.major_flags))
+        pack_u32 = U32.pack
+        sin = hashed_sin.encode("utf-8")
+        name = record.name.encode("utf-8")
+        address = record.address.encode("utf-8")
+        parts = [
+            pack_u32(len(sin)), sin,
+            pack_u32(len(name)), name,
+            pack_u32(len(address)), address,
+            FIXED_FIELDS.pack(record.credit_score, record.account_count, record.major_flags),
+        ]
         for acc in record.accounts:
-            CreditReportWriter.write_string(f, acc.name)
-            f.write(struct.pack("<i", acc.balance))  # writes account balance as 4-byte signed integer
-        
-        end_pos = f.tell()  # determines ending position
-        return end_pos - start_pos  # returns total size of the record
+            if dictionary is not None:
+                code = dictionary.get(acc.name)
+                if code is None and len(dictionary) < DICTIONARY_LIMIT:
+                    code = dictionary[acc.name] = len(dictionary)
+                if code is not None:
+                    parts += (pack_u32(DICTIONARY_CODE | code), BALANCE.pack(acc.balance))
+                    continue
+            acc_name = acc.name.encode("utf-8")
+            parts += (pack_u32(len(acc_name)), acc_name, BALANCE.pack(acc.balance))
+        return b"".join(parts)  # one allocation for the whole record
+
+    @staticmethod
+    def write_file(filename: str, records: List[CreditRecord], encryption_key: bytes, version: int = VERSION,
+                   workers: int = 1, compression: str = None, secondary_indexes: bool = False, dictionary: bool = False,
+                   stats: CRFStats = None, bloom_filter: bool = False):
+        if version == LEGACY_VERSION:  # single whole-file token, so there is nothing to spread over workers
+            if compression is not None or secondary_indexes or dictionary or bloom_filter:
+                raise ValueError("Compression, secondary indexes, dictionary encoding and Bloom filters require a v3 file.")
+            return CreditReportWriter._write_legacy_file(filename, records, encryption_key)
+        if version != VERSION:
+            raise ValueError(f"Unsupported file version: {version}")
+
+        with CreditReportWriter.open(filename, encryption_key, workers=workers, compression=compression,
+                                     secondary_indexes=secondary_indexes, dictionary=dictionary, stats=stats,
+                                     bloom_filter=bloom_filter) as writer:
+            writer.extend(records)
+
+    @staticmethod
+    def open(filename: str, encryption_key: bytes, segment_size: int = None, workers: int = 1,
+             compression: str = None, secondary_indexes: bool = False, dictionary: bool = False,
+             stats: CRFStats = None, bloom_filter: bool = False) -> "CreditReportStreamWriter":
+        return CreditReportStreamWriter(filename, encryption_key, segment_size, workers, compression, secondary_indexes,
+                                        dictionary, stats, bloom_filter)
+
+    @staticmethod
+    def _compression_codec(compression: str) -> int:
+        if compression not in COMPRESSION_CODECS:
+            raise ValueError(f"Unsupported compression: {compression}")
+        if compression == "zstd" and zstandard is None:
+            raise ImportError("zstd compression requires the zstandard package.")
+        return COMPRESSION_CODECS[compression]
+
+    @staticmethod
+    def _compress(codec: int, data: bytes) -> bytes:
+        if codec == COMPRESSION_ZLIB:
+            return zlib.compress(data, 6)
+        if codec == COMPRESSION_LZMA:
+            return lzma.compress(data)
+        if codec == COMPRESSION_ZSTD:
+            return zstandard.ZstdCompressor().compress(data)
+        return data
+
+    @staticmethod
+    def _encode_batch(batch: List[tuple], dictionary: Dict[str, int] = None) -> tuple:
+        # runs in a worker process: hashes and encodes (record, hashed SIN or None) pairs,
+        # returned as one buffer plus per-record sizes and the names this batch added to its copy of the dictionary
+        known = len(dictionary) if dictionary is not None else 0
+        hashes, sizes, parts = [], [], []
+        for record, hashed_sin in batch:
+            if hashed_sin is None:
+                hashed_sin = hashlib.sha256(record.sin.encode()).hexdigest()
+            data = CreditReportWriter.encode_record(record, hashed_sin, dictionary)
+            hashes.append(hashed_sin)
+            sizes.append(len(data))
+            parts.append(data)
+        new_names = list(dictionary)[known:] if dictionary is not None else []
+        return hashes, sizes, b"".join(parts), new_names
+
+    @staticmethod
+    def _check_record(record: CreditRecord):
+        # raises ValueError for the values encode_record cannot pack, without encoding the strings
+        try:
+            FIXED_FIELDS.pack(record.credit_score, record.account_count, record.major_flags)
+            for acc in record.accounts:
+                BALANCE.pack(acc.balance)
+        except struct.error as e:
+            raise ValueError(f"Record cannot be encoded: {e}") from None
+
+    @staticmethod
+    def _sin_digest(hashed_sin: str) -> bytes:
+        # 32-byte form of a hex SHA-256 SIN hash, as kept in the stream writer's packed index
+        try:
+            digest = bytes.fromhex(hashed_sin)
+        except (TypeError, ValueError):
+            digest = b""
+        if len(digest) != 32:
+            raise ValueError(f"Not a hashed SIN: {hashed_sin!r}")
+        return digest
+
+    @staticmethod
+    def _encrypt_segment(encryption_key: bytes, payload: bytes, codec: int = COMPRESSION_NONE) -> tuple:
+        # runs in a worker process, so compression, encryption and the token digest are all parallelized
+        token = Fernet(encryption_key).encrypt(CreditReportWriter._compress(codec, payload))
+        return token, hashlib.sha256(token).digest()
+
+    @staticmethod
+    def _mac_key(encryption_key: bytes) -> bytes:
+        # derived from the Fernet key so the header MAC never reuses Fernet's own signing key
+        return hmac.new(base64.urlsafe_b64decode(encryption_key), b"CRF header", hashlib.sha256).digest()
+
+    @staticmethod
+    def _write_header(f, encryption_key: bytes, flags: int, record_count: int, segments: list, sections: Dict[bytes, bytes]):
+        # header tables: tagged plaintext blocks, starting with the segment table
+        tables = io.BytesIO()
+        sections = {b"SEGS": b"".join(SEGMENT_ENTRY.pack(*entry) for entry in segments), **sections}
+        for tag, data in sections.items():
+            tables.write(SECTION.pack(tag, len(data)))
+            tables.write(data)
+        tables_data = tables.getvalue()
+        tables_offset = f.tell()
+        f.write(tables_data)
+
+        # fixed-size header is not encrypted, only authenticated, so metadata reads never touch Fernet
+        header = HEADER.pack(Magic_Number, VERSION, flags, record_count, len(segments),
+                             tables_offset, len(tables_data), hashlib.sha256(tables_data).digest())
+        f.write(header)
+        f.write(CreditReportWriter._header_mac(encryption_key, header))
+        f.write(Footer)
+
+    @staticmethod
+    def _bloom_key(encryption_key: bytes) -> bytes:
+        # the filter sits in plaintext and SINs are only 9 digits, so it is keyed to stop brute-force membership tests
+        return hmac.new(base64.urlsafe_b64decode(encryption_key), b"CRF bloom", hashlib.sha256).digest()
+
+    @staticmethod
+    def _bloom_filter(encryption_key: bytes, hashes: Iterable[str], count: int) -> bytes:
+        # BLOM header section: probe count, then the bit array
+        bits = bytearray(max(8, -(-count * BLOOM_BITS_PER_SIN // 8)))
+        CreditReportWriter._bloom_add(bits, encryption_key, hashes, BLOOM_HASHES)
+        return U32.pack(BLOOM_HASHES) + bytes(bits)
+
+    @staticmethod
+    def _bloom_add(bits: bytearray, encryption_key: bytes, hashes: Iterable[str], hash_count: int):
+        bloom_key = CreditReportWriter._bloom_key(encryption_key)
+        size = len(bits) * 8
+        for sin_hash in hashes:
+            first, step = BLOOM_PROBE.unpack(hashlib.blake2b(sin_hash.encode(), key=bloom_key, digest_size=16).digest())
+            for i in range(hash_count):
+                position = (first + i * step) % size
+                bits[position >> 3] |= 1 << (position & 7)
+
+    @staticmethod
+    def _header_mac(encryption_key: bytes, header: bytes) -> bytes:
+        return hmac.new(CreditReportWriter._mac_key(encryption_key), header, hashlib.sha256).digest()
+
+    @staticmethod
+    def _write_segment(f, fernet: Fernet, payload: bytes, record_count: int, codec: int = COMPRESSION_NONE,
+                       stats: CRFStats = None) -> tuple:
+        offset, length, digest = CreditReportWriter._write_block(f, fernet, payload, codec, stats)
+        return (offset, length, record_count, digest)
+
+    @staticmethod
+    def _write_block(f, fernet: Fernet, payload: bytes, codec: int = COMPRESSION_NONE, stats: CRFStats = None) -> tuple:
+        # returns (offset, length, SHA-256 of the token); the digest goes into the MAC'd header tables, which
+        # ties every token to its place, so one cannot be swapped for another token encrypted with the same key
+        offset = f.tell()
+        if stats is None:
+            token = fernet.encrypt(CreditReportWriter._compress(codec, payload))  # each block is its own authenticated Fernet token
+            f.write(token)
+            return (offset, len(token), hashlib.sha256(token).digest())
+
+        started = perf_counter()
+        data = CreditReportWriter._compress(codec, payload)
+        compressed = perf_counter()
+        token = fernet.encrypt(data)
+        encrypted = perf_counter()
+        f.write(token)
+        if codec != COMPRESSION_NONE:
+            stats.add("compress", compressed - started, len(payload))
+        stats.add("encrypt", encrypted - compressed, len(data))
+        stats.add("write", perf_counter() - encrypted, len(token))
+        return (offset, len(token), hashlib.sha256(token).digest())
+
+    @staticmethod
+    def _write_index_buckets(f, fernet: Fernet, index: Dict[str, tuple], codec: int = COMPRESSION_NONE,
+                             stats: CRFStats = None) -> list:
+        # split the index by hash prefix so a lookup only decrypts the one bucket its SIN falls in
+        bucket_count = max(1, -(-len(index) // INDEX_BUCKET_SIZE))
+        partitions = [{} for _ in range(bucket_count)]
+        for sin_hash, location in index.items():
+            partitions[CreditReportWriter._index_bucket(sin_hash, bucket_count)][sin_hash] = location
+        return CreditReportWriter._write_partitions(f, fernet, partitions, codec, stats)
+
+    @staticmethod
+    def _write_partitions(f, fernet: Fernet, partitions: Iterable[Dict[str, tuple]], codec: int = COMPRESSION_NONE,
+                          stats: CRFStats = None) -> list:
+        # one encrypted index bucket per partition, in bucket order
+        started = perf_counter() if stats is not None else 0
+        buckets = []
+        for partition in partitions:
+            payload = CreditReportWriter._serialize_segment_index(partition)
+            if stats is not None:
+                stats.add("index", perf_counter() - started, len(payload))
+            buckets.append(CreditReportWriter._write_block(f, fernet, payload, codec, stats))
+            started = perf_counter() if stats is not None else 0
+        return buckets
 
     @staticmethod
-    def write_file(filename: str, records: List[CreditRecord], encryption_key: bytes):
+    def _index_bucket(sin_hash: str, bucket_count: int) -> int:
+        return int(sin_hash[:8], 16) % bucket_count  # SHA-256 prefix is uniform, so buckets stay balanced
+
+    @staticmethod
+    def _write_legacy_file(filename: str, records: List[CreditRecord], encryption_key: bytes):
         buffer = io.BytesIO()  # collect all data in memory before encrypting with Fernet
         
         # Write header
         buffer.write(Magic_Number)  # magic number for file identification
-        buffer.write(struct.pack("<H", VERSION))  # 2-byte unsigned short version
+        buffer.write(struct.pack("<H", LEGACY_VERSION))  # 2-byte unsigned short version
         buffer.write(struct.pack("<I", len(records)))  # number of records as a 4-byte unsigned int
         
         # Build index in a temporary buffer first
@@ -109,6 +358,337 @@ class CreditReportWriter:
             buffer.write(struct.pack("<I", offset))            # byte offset for each record
         return buffer.getvalue()
 
+    @staticmethod
+    def _serialize_segment_index(index: Dict[str, tuple]) -> bytes:
+        buffer = io.BytesIO()
+        buffer.write(struct.pack("<I", len(index)))  # number of entries in the index
+        for sin_hash, (segment, offset) in index.items():
+            CreditReportWriter.write_string(buffer, sin_hash)   # hash key
+            buffer.write(INDEX_LOCATION.pack(segment, offset))  # segment number + offset inside that segment
+        return buffer.getvalue()
+
+    @staticmethod
+    def _serialize_dictionary(dictionary: Dict[str, int]) -> bytes:
+        buffer = io.BytesIO()
+        buffer.write(U32.pack(len(dictionary)))
+        for name in dictionary:  # insertion order is code order
+            CreditReportWriter.write_string(buffer, name)
+        return buffer.getvalue()
+
+    @staticmethod
+    def _serialize_score_index(scores: array) -> bytes:
+        # entry count, then every credit score in ascending order, then the record ordinal of each score
+        order = array("I", sorted(range(len(scores)), key=scores.__getitem__))
+        sorted_scores = array("I", (scores[ordinal] for ordinal in order))
+        return U32.pack(len(order)) + CreditReportWriter._u32_bytes(sorted_scores) + CreditReportWriter._u32_bytes(order)
+
+    @staticmethod
+    def _serialize_flag_index(flags: Dict[int, array], record_count: int) -> bytes:
+        # value count, then per major_flags value: value, bitmap length, bitmap with bit i set for record ordinal i
+        buffer = io.BytesIO()
+        buffer.write(U32.pack(len(flags)))
+        for value, ordinals in sorted(flags.items()):
+            bitmap = bytearray((record_count + 7) // 8)
+            for ordinal in ordinals:
+                bitmap[ordinal >> 3] |= 1 << (ordinal & 7)
+            buffer.write(INDEX_LOCATION.pack(value, len(bitmap)))
+            buffer.write(bitmap)
+        return buffer.getvalue()
+
+    @staticmethod
+    def _u32_bytes(values: array) -> bytes:
+        if sys.byteorder != "little":  # arrays are native-endian, the file format is little-endian
+            values = array("I", values)
+            values.byteswap()
+        return values.tobytes()
+
     @staticmethod
     def generate_key() -> bytes:
         return Fernet.generate_key()  # generates encryption key
+
+
+class CreditReportStreamWriter:
+    # Writes a v3 file one record at a time; each full segment is encrypted and flushed to disk
+    # as soon as it fills, and the index, record count and header are written on close(). Everything
+    # goes to filename + ".tmp", which replaces filename in one step once the header is written.
+    # With workers > 1, record encoding and segment encryption run in a process pool while this
+    # process only cuts segments and writes tokens in order, so the layout matches workers=1.
+    def __init__(self, filename: str, encryption_key: bytes, segment_size: int = None, workers: int = 1,
+                 compression: str = None, secondary_indexes: bool = False, dictionary: bool = False,
+                 stats: CRFStats = None, bloom_filter: bool = False):
+        self.filename = filename
+        self.compression = compression
+        self._codec = CreditReportWriter._compression_codec(compression)
+        self.segment_size = segment_size or SEGMENT_SIZE
+        self.workers = workers
+        self.record_count = 0
+        self.closed = False
+        self._encryption_key = encryption_key
+        self._fernet = Fernet(encryption_key)
+        self._hashes = bytearray()          # 32-byte hashed SIN of every record, in append order
+        self._locations = array("I")        # (segment number, offset inside the decrypted segment) of each, in pairs
+        self._segments = []                 # (file offset, token length, record count) for every written segment
+        self._segment = bytearray()         # only the current segment's plaintext is held in memory
+        self._segment_records = 0
+        self._segment_number = 0            # segments sealed so far, written or still being encrypted
+        self.secondary_indexes = secondary_indexes
+        self._scores = array("I")           # credit score of every record, by record ordinal
+        self._flags: Dict[int, array] = {}  # major_flags value → ordinals of the records that carry it
+        self._dictionary: Dict[str, int] = {} if dictionary else None  # account name → code, one per file
+        self.bloom_filter = bloom_filter    # built from every hashed SIN on close, so it is opt-in
+        self._stats = stats
+
+        self._temp_file = filename + ".tmp"    # the target is only replaced once the file is complete
+        self._file = open(self._temp_file, "wb")  # opened before the pool, so a bad path leaves no processes behind
+        self._file.write(Magic_Number)       # plaintext preamble so readers can tell v3 from v1/v2
+        self._file.write(struct.pack("<H", VERSION))
+
+        self._pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+        self._batch = []                    # records waiting to be sent to the pool for encoding
+        self._encoding = deque()            # encode futures, consumed in submission order
+        self._encrypting = deque()          # (encrypt future, record count), written in submission order
+
+    def append(self, record: CreditRecord, hashed_sin: str = None):
+        # hashed_sin is for records that already carry a hashed SIN, such as records read back from a file
+        if self.closed:
+            raise ValueError("Writer is closed.")
+        # a record that cannot be written raises ValueError before anything is counted, so the caller can skip it
+        if self._pool is None:
+            if self._stats is not None:
+                digest, data = self._encode_measured(record, hashed_sin)
+            else:
+                if hashed_sin is None:
+                    digest = hashlib.sha256(record.sin.encode()).digest()
+                    hashed_sin = digest.hex()
+                else:
+                    digest = CreditReportWriter._sin_digest(hashed_sin)
+                try:
+                    data = CreditReportWriter.encode_record(record, hashed_sin, self._dictionary)
+                except struct.error as e:
+                    raise ValueError(f"Record cannot be encoded: {e}") from None
+            self._count(record)
+            self._add_encoded(digest, data)
+            return
+        # encoding happens in the pool, so the values it would reject are checked here instead
+        if hashed_sin is not None:
+            CreditReportWriter._sin_digest(hashed_sin)
+        CreditReportWriter._check_record(record)
+        self._count(record)
+        self._batch.append((record, hashed_sin))
+        if len(self._batch) >= ENCODE_BATCH:
+            self._submit_batch()
+
+    def _count(self, record: CreditRecord):
+        if self.secondary_indexes:  # ordinals follow append order, which is also the order records land in segments
+            self._scores.append(record.credit_score)
+            self._flags.setdefault(record.major_flags, array("I")).append(self.record_count)
+        self.record_count += 1
+
+    def _encode_measured(self, record: CreditRecord, hashed_sin: str) -> tuple:
+        # same as the workers=1 branch of append(), timing hashing and encoding separately
+        started = perf_counter()
+        if hashed_sin is None:
+            digest = hashlib.sha256(record.sin.encode()).digest()
+            hashed_sin = digest.hex()
+        else:
+            digest = CreditReportWriter._sin_digest(hashed_sin)
+        hashed = perf_counter()
+        try:
+            data = CreditReportWriter.encode_record(record, hashed_sin, self._dictionary)
+        except struct.error as e:
+            raise ValueError(f"Record cannot be encoded: {e}") from None
+        self._stats.add("hash", hashed - started)
+        self._stats.add("encode", perf_counter() - hashed, len(data))
+        return digest, data
+
+    def extend(self, records: Iterable[CreditRecord]):
+        for record in records:  # works with generators and database cursors, nothing is materialized
+            self.append(record)
+
+    def flush(self):
+        # pushes every appended record through to disk as complete segments
+        if self._pool is not None:
+            if self._batch:
+                self._submit_batch()
+            while self._encoding:
+                self._collect_batch()
+        self._seal_segment()
+        while self._encrypting:
+            self._write_encrypted()
+
+    def _add_encoded(self, digest: bytes, data: bytes):
+        self._hashes += digest  # packed, about 40 bytes per record instead of a dict entry's 400
+        self._locations.append(self._segment_number)
+        self._locations.append(len(self._segment))
+        self._segment += data
+        self._segment_records += 1
+        if len(self._segment) >= self.segment_size:  # segment is full, encrypt it and start the next one
+            self._seal_segment()
+
+    def _seal_segment(self):
+        if not self._segment_records:
+            return
+        payload = bytes(self._segment)
+        if self._pool is None:
+            self._segments.append(CreditReportWriter._write_segment(
+                self._file, self._fernet, payload, self._segment_records, self._codec, self._stats))
+        else:
+            future = self._pool.submit(CreditReportWriter._encrypt_segment, self._encryption_key, payload, self._codec)
+            self._encrypting.append((future, self._segment_records))
+            while len(self._encrypting) > self.workers * 2:  # backpressure: bounded plaintext in flight
+                self._write_encrypted()
+        self._segment = bytearray()
+        self._segment_records = 0
+        self._segment_number += 1
+
+    def _submit_batch(self):
+        # the batch is encoded against a snapshot of the dictionary; the batch itself is kept for _collect_batch
+        known = len(self._dictionary) if self._dictionary is not None else 0
+        self._encoding.append((self._pool.submit(CreditReportWriter._encode_batch, self._batch, self._dictionary),
+                               self._batch, known))
+        self._batch = []
+        while len(self._encoding) > self.workers * 2:
+            self._collect_batch()
+
+    def _collect_batch(self):
+        future, batch, known = self._encoding.popleft()
+        if self._stats is None:
+            hashes, sizes, data, new_names = future.result()
+        else:  # hashing and encoding run in the pool; what is measured here is the time spent waiting on them
+            started = perf_counter()
+            hashes, sizes, data, new_names = future.result()
+            self._stats.add("encode", perf_counter() - started, len(data))
+        if new_names:
+            if len(self._dictionary) == known:  # nothing was added since the snapshot, so the worker's codes hold
+                for name in new_names:
+                    self._dictionary[name] = len(self._dictionary)
+            else:  # an earlier batch took those codes first; rare once the vocabulary is known
+                hashes, sizes, data, _ = CreditReportWriter._encode_batch(batch, self._dictionary)
+        position = 0
+        for hashed_sin, size in zip(hashes, sizes):
+            self._add_encoded(bytes.fromhex(hashed_sin), data[position:position + size])
+            position += size
+
+    def _append_encoded(self, encoded: tuple, known: int, scores: array, flags: array) -> bool:
+        # adds records hashed and encoded outside the writer (see crf_import): the output of _encode_batch
+        # against a dictionary snapshot of `known` names, plus each record's credit score and major flags.
+        # Returns False, adding nothing, if another batch took the new dictionary codes first
+        if self._pool is not None and (self._batch or self._encoding):  # keep append order with earlier records
+            if self._batch:
+                self._submit_batch()
+            while self._encoding:
+                self._collect_batch()
+        hashes, sizes, data, new_names = encoded
+        if new_names:
+            if len(self._dictionary) != known:
+                return False
+            for name in new_names:
+                self._dictionary[name] = len(self._dictionary)
+        if self.secondary_indexes:
+            for score, flag in zip(scores, flags):
+                self._scores.append(score)
+                self._flags.setdefault(flag, array("I")).append(self.record_count)
+                self.record_count += 1
+        else:
+            self.record_count += len(hashes)
+        position = 0
+        for hashed_sin, size in zip(hashes, sizes):
+            self._add_encoded(bytes.fromhex(hashed_sin), data[position:position + size])
+            position += size
+        return True
+
+    def _write_encrypted(self):
+        future, record_count = self._encrypting.popleft()
+        started = perf_counter() if self._stats is not None else 0
+        token, digest = future.result()
+        waited = perf_counter() if self._stats is not None else 0
+        self._segments.append((self._file.tell(), len(token), record_count, digest))
+        self._file.write(token)
+        if self._stats is not None:  # compression and encryption run in the pool, measured as time spent waiting
+            self._stats.add("encrypt", waited - started, len(token))
+            self._stats.add("write", perf_counter() - waited, len(token))
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self.flush()
+            stats = self._stats
+            buckets = CreditReportWriter._write_partitions(self._file, self._fernet, self._index_partitions(), self._codec, stats)
+            started = perf_counter() if stats is not None else 0
+            sections = {b"IDXB": b"".join(BUCKET_ENTRY.pack(*entry) for entry in buckets)}
+            if self.bloom_filter:
+                sections[b"BLOM"] = CreditReportWriter._bloom_filter(self._encryption_key, self._hex_hashes(),
+                                                                     len(self._locations) // 2)
+            blocks = {}
+            if self.secondary_indexes:  # encrypted like everything else, scores and flags are as sensitive as the records
+                blocks[b"SCOR"] = CreditReportWriter._serialize_score_index(self._scores)
+                blocks[b"FLAG"] = CreditReportWriter._serialize_flag_index(self._flags, self.record_count)
+            if self._dictionary is not None:
+                blocks[b"DICT"] = CreditReportWriter._serialize_dictionary(self._dictionary)
+            if stats is not None:
+                stats.add("index", perf_counter() - started,
+                          len(sections.get(b"BLOM", b"")) + sum(len(data) for data in blocks.values()))
+            for tag, data in blocks.items():
+                sections[tag] = BUCKET_ENTRY.pack(*CreditReportWriter._write_block(self._file, self._fernet, data, self._codec, stats))
+
+            started = perf_counter() if stats is not None else 0
+            header_offset = self._file.tell()
+            CreditReportWriter._write_header(self._file, self._encryption_key, self._codec, self.record_count, self._segments, sections)
+            if stats is not None:
+                stats.add("header", perf_counter() - started, self._file.tell() - header_offset)
+                stats.records += self.record_count
+            self._file.close()
+        except BaseException:  # a record that failed to encode in the pool surfaces here; leave nothing behind
+            self.abort()
+            raise
+        self.closed = True
+        if self._pool is not None:
+            self._pool.shutdown()
+        os.replace(self._temp_file, self.filename)  # atomic on the same filesystem
+
+    def _hex_hashes(self) -> Iterator[str]:
+        hashes = self._hashes
+        return (hashes[position:position + 32].hex() for position in range(0, len(hashes), 32))
+
+    def _index_partitions(self) -> Iterator[Dict[str, tuple]]:
+        # yields the index one bucket at a time, so only one bucket's dict is ever built. Records are
+        # counting-sorted by bucket, keeping append order inside each, so a SIN appended twice keeps its last location
+        hashes, locations = self._hashes, self._locations
+        count = len(locations) // 2
+        bucket_count = max(1, -(-count // INDEX_BUCKET_SIZE))
+        bucket_of = array("I", (int.from_bytes(hashes[position:position + 4], "big") % bucket_count  # as _index_bucket
+                                for position in range(0, len(hashes), 32)))
+        starts = array("I", [0]) * (bucket_count + 1)
+        for bucket in bucket_of:
+            starts[bucket + 1] += 1
+        for bucket in range(bucket_count):
+            starts[bucket + 1] += starts[bucket]
+        order = array("I", [0]) * count
+        fill = array("I", starts)
+        for ordinal, bucket in enumerate(bucket_of):
+            order[fill[bucket]] = ordinal
+            fill[bucket] += 1
+        del bucket_of, fill
+        for bucket in range(bucket_count):
+            yield {hashes[ordinal * 32:ordinal * 32 + 32].hex(): (locations[2 * ordinal], locations[2 * ordinal + 1])
+                   for ordinal in order[starts[bucket]:starts[bucket + 1]]}
+
+    def abort(self):
+        # drops the half-written temporary file, a file already at filename is left untouched
+        if self.closed:
+            return
+        self.closed = True
+        self._file.close()
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+        os.remove(self._temp_file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
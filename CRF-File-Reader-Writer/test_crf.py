@@ -1,6 +1,21 @@
-from crf_writer import CreditReportWriter, CreditRecord, Account
+from crf_writer import CreditReportWriter, CreditReportStreamWriter, CreditRecord, Account
 from crf_reader import CreditReportReader
+from crf_delta import CreditReportDelta
+from crf_rekey import CreditReportRekeyer
+from crf_cache import CRFCache
+from crf_dataset import CreditReportDataset
+from crf_merge import MERGE_FAN_IN, CreditReportMerge
+from crf_import import CreditReportImporter
+from crf_async import AsyncCreditReportReader, AsyncCreditReportWriter
+from crf_shared import SharedCreditReport
+import asyncio
+import copy
+import csv
+import hashlib
+import io
+import json
 import os
+import tempfile
 
 # Sample data set 1
 sample_1_records = [
@@ -72,27 +87,498 @@ sample_2_records = [
     )
 ]
 
-script_dir = os.path.dirname(os.path.abspath(__file__)) # finds file path of test script
+# Round-trip checks, collected by pytest; running this script also runs them after the demo below
 
-key_1 = CreditReportWriter.generate_key() # generates encryption keys
-key_2 = CreditReportWriter.generate_key()
+def as_tuples(records): # records read back carry the hashed SIN, so compare against hashed copies
+    return sorted((record.sin, record.name, record.address, record.credit_score, record.major_flags,
+                   [(acc.name, acc.balance) for acc in record.accounts]) for record in records)
 
-file_path_1 = os.path.join(script_dir, "sample_1.crf")
-file_path_2 = os.path.join(script_dir, "sample_2.crf")
+def hashed(records):
+    copies = copy.deepcopy(records)
+    for record in copies:
+        record.sin = hashlib.sha256(record.sin.encode()).hexdigest()
+    return copies
 
-print("Writing CRF files")
-CreditReportWriter.write_file(file_path_1, sample_1_records, key_1) # calls writer to write into 2 filepaths, 2 different records and 2 different keys
-CreditReportWriter.write_file(file_path_2, sample_2_records, key_2)
-print(f"CRF 1 File Created: {file_path_1}")
-print(f"CRF 2 File Created: {file_path_2}")
+def test_append_supersedes_and_compact():
+    key = CreditReportWriter.generate_key()
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "delta.crf")
+        CreditReportWriter.write_file(path, sample_1_records, key)
+        updated = copy.deepcopy(sample_1_records[2])
+        updated.credit_score = 810 # supersedes Carol Williams' record
+        CreditReportDelta.append_file(path, [updated] + sample_2_records, key)
+        expected = as_tuples(hashed(sample_1_records[:2] + [updated] + sample_2_records))
+        assert as_tuples(CreditReportReader.read_file(path, key)) == expected
+        assert CreditReportReader.read_metadata(path, key).record_count == 5 # superseded records count once
+        assert CreditReportReader.find_by_sin(path, "676767676", key).credit_score == 810
 
-keys_file = os.path.join(script_dir, "encryption_keys.txt") # stores keys in text file, will be stored in secure database, etc.
-with open(keys_file, "w") as f:
-    f.write(f"sample_1.crf key: {key_1.decode()}\n")
-    f.write(f"sample_2.crf key: {key_2.decode()}\n")
-print(f"Keys saved to: {keys_file}") # saves decoded keys to encryption_keys.txt file
+        CreditReportDelta.compact(path, key)
+        assert as_tuples(CreditReportReader.read_file(path, key)) == expected
+        assert not CreditReportReader.read_header(path, key).deltas
+
+def test_recover_torn_append():
+    key = CreditReportWriter.generate_key()
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "torn.crf")
+        CreditReportWriter.write_file(path, sample_1_records, key)
+        before = os.path.getsize(path)
+        CreditReportDelta.append_file(path, sample_2_records, key)
+        with open(path, "r+b") as f:
+            f.truncate(os.path.getsize(path) - 10) # the new header never made it to disk
+        try:
+            CreditReportReader.read_file(path, key)
+            raise AssertionError("a torn append was not detected")
+        except ValueError:
+            pass
+        assert CreditReportDelta.recover(path, key) > 0 and os.path.getsize(path) == before
+        assert as_tuples(CreditReportReader.read_file(path, key)) == as_tuples(hashed(sample_1_records))
+        assert CreditReportDelta.recover(path, key) == 0 # nothing left to drop
+
+def test_swapped_tokens_are_rejected():
+    key = CreditReportWriter.generate_key()
+    records = [CreditRecord(f"{i:09d}", f"Person {i:04d}", "addr", 500 + i, 0, 0, []) for i in range(20)]
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "swap.crf")
+        with CreditReportWriter.open(path, key, segment_size=5 * len(CreditReportWriter.encode_record(records[0]))) as writer:
+            writer.extend(records) # equal-sized records, so every segment token has the same length
+        (offset_1, length, _, _), (offset_2, _, _, _) = CreditReportReader.read_header(path, key).segments[:2]
+        with open(path, "r+b") as f: # two valid tokens under the same key, swapped
+            f.seek(offset_1)
+            token_1 = f.read(length)
+            f.seek(offset_2)
+            token_2 = f.read(length)
+            f.seek(offset_1)
+            f.write(token_2)
+            f.seek(offset_2)
+            f.write(token_1)
+        for read in (lambda: CreditReportReader.read_file(path, key),
+                     lambda: CreditReportReader.find_by_sin(path, "000000000", key)):
+            try:
+                read()
+                raise AssertionError("swapped segments were accepted")
+            except ValueError as e:
+                assert "digest mismatch" in str(e)
+
+def generated_records(count, names=("Chequing", "Savings", "Credit Card", "Line of Credit", "Auto Loan")):
+    return [CreditRecord(sin=f"{i:09d}", name=f"Person {i}", address=f"{i} Main St", credit_score=300 + i % 600,
+                         account_count=i % 4, major_flags=i % 3,
+                         accounts=[Account(names[(i + j) % len(names)], i * 10 - j) for j in range(i % 4)])
+            for i in range(count)]
+
+def test_failed_write_keeps_existing_file():
+    key = CreditReportWriter.generate_key()
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "existing.crf")
+        CreditReportWriter.write_file(path, sample_1_records, key)
+        with open(path, "rb") as f:
+            before = f.read()
+        try:
+            with CreditReportWriter.open(path, key) as writer:
+                writer.extend(sample_2_records)
+                raise RuntimeError("export interrupted")
+        except RuntimeError:
+            pass
+        with open(path, "rb") as f:
+            assert f.read() == before # only the temporary file was written to
+        assert os.listdir(directory) == ["existing.crf"]
+
+def test_skipped_append_keeps_file_readable():
+    key = CreditReportWriter.generate_key()
+    with tempfile.TemporaryDirectory() as directory:
+        for workers in (1, 2):
+            path = os.path.join(directory, f"skipped_{workers}.crf")
+            records = generated_records(10)
+            records[3].accounts = [Account("Overflow", 2**31)] # does not fit a 4-byte balance
+            records[3].account_count = 1
+            records[6].credit_score = -1
+            kept = []
+            with CreditReportWriter.open(path, key, workers=workers) as writer:
+                for record in records: # a database cursor export that skips rows it cannot write
+                    try:
+                        writer.append(record)
+                        kept.append(record)
+                    except ValueError:
+                        pass
+                try:
+                    writer.append(records[0], hashed_sin="not a hash")
+                    raise AssertionError("a malformed hashed_sin was accepted")
+                except ValueError:
+                    pass
+            assert len(kept) == 8
+            assert as_tuples(CreditReportReader.read_file(path, key)) == as_tuples(hashed(kept))
+
+def test_packed_index_keeps_last_duplicate():
+    key = CreditReportWriter.generate_key()
+    records = generated_records(9000) # more than one index bucket
+    updates = copy.deepcopy(records[::7])
+    for record in updates:
+        record.name += " (updated)"
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "duplicates.crf")
+        CreditReportWriter.write_file(path, records + updates, key)
+        assert len(CreditReportReader.read_header(path, key).buckets) > 1
+        found = CreditReportReader.find_by_sins(path, [f"{i:09d}" for i in range(0, 9000, 3)] + ["999999999"], key)
+        assert len(found) == 3000
+        for sin, record in found.items():
+            assert record.name == f"Person {int(sin)}" + (" (updated)" if int(sin) % 7 == 0 else "")
+
+def test_worker_failure_aborts_the_file():
+    key = CreditReportWriter.generate_key()
+    records = generated_records(3000)
+    records[2500].name = None # passes append's range checks, fails to encode in a worker
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "workers.crf")
+        try:
+            CreditReportWriter.write_file(path, records, key, workers=2)
+            raise AssertionError("the worker's error was swallowed")
+        except AttributeError:
+            pass
+        assert os.listdir(directory) == [] # neither a header-less file nor its temporary file
+
+        writer = CreditReportWriter.open(path, key, workers=2)
+        writer.extend(records)
+        try:
+            writer.close() # the failing batch is only collected here
+            raise AssertionError("the worker's error was swallowed")
+        except AttributeError:
+            pass
+        assert writer.closed and os.listdir(directory) == []
+
+def test_rekey():
+    key = CreditReportWriter.generate_key()
+    new_key = CreditReportWriter.generate_key()
+    updated = copy.deepcopy(sample_1_records[2])
+    updated.credit_score = 810
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "rekey.crf")
+        CreditReportWriter.write_file(path, sample_1_records, key, dictionary=True, bloom_filter=True)
+        CreditReportDelta.append_file(path, [updated], key)
+        CreditReportRekeyer.rekey_file(path, key, new_key)
+        assert CreditReportReader.find_by_sin(path, "676767676", new_key).credit_score == 810
+        header = CreditReportReader.read_header(path, new_key)
+        assert not header.deltas # compacted, so no dead tokens stay under the old key
+        assert header.dictionary is not None and CreditReportReader.might_contain(path, "676767676", new_key)
+        try:
+            CreditReportReader.read_file(path, key)
+            raise AssertionError("the old key still reads the file")
+        except ValueError:
+            pass
+
+        CreditReportRekeyer.rekey_file(path, [new_key], key) # no deltas left, rotated in place
+        assert as_tuples(CreditReportReader.read_file(path, key)) == as_tuples(hashed(sample_1_records[:2] + [updated]))
+        assert CreditReportReader.might_contain(path, "676767676", key)
+
+def test_secondary_indexes_after_skipped_append():
+    key = CreditReportWriter.generate_key()
+    records = generated_records(600)
+    records[100].credit_score = -1 # rejected by append, must not shift the ordinals after it
+    kept = records[:100] + records[101:]
+    with tempfile.TemporaryDirectory() as directory:
+        for workers in (1, 2):
+            path = os.path.join(directory, f"indexes_{workers}.crf")
+            with CreditReportWriter.open(path, key, workers=workers, secondary_indexes=True) as writer:
+                for record in records:
+                    try:
+                        writer.append(record)
+                    except ValueError:
+                        pass
+            assert (as_tuples(CreditReportReader.find_by_flags(path, [1], key))
+                    == as_tuples(hashed([record for record in kept if record.major_flags == 1])))
+            assert (as_tuples(CreditReportReader.find_by_score(path, 700, 800, key))
+                    == as_tuples(hashed([record for record in kept if 700 <= record.credit_score <= 800])))
+
+def test_dictionary_encoding():
+    key = CreditReportWriter.generate_key()
+    records = generated_records(5000)
+    with tempfile.TemporaryDirectory() as directory:
+        for workers in (1, 2):
+            path = os.path.join(directory, f"dictionary_{workers}.crf")
+            CreditReportWriter.write_file(path, records, key, workers=workers, dictionary=True)
+            assert CreditReportReader.read_header(path, key).dictionary is not None
+            assert as_tuples(CreditReportReader.read_file(path, key)) == as_tuples(hashed(records))
+            found = CreditReportReader.find_by_sin(path, "000000007", key)
+            assert [(acc.name, acc.balance) for acc in found.accounts] == [(acc.name, acc.balance) for acc in records[7].accounts]
+
+    names = {} # encode_record fills in the dictionary as it meets new names
+    data = b"".join(CreditReportWriter.encode_record(record, record.sin, names) for record in records[1:51])
+    stream = io.BytesIO(data)
+    assert [repr(CreditReportReader.read_record(stream, list(names))) for _ in range(50)] == list(map(repr, records[1:51]))
+    try:
+        CreditReportReader.read_record(io.BytesIO(data)) # record 1 has one account, its name is coded
+        raise AssertionError("a coded account name was read without a dictionary")
+    except ValueError:
+        pass
+
+def test_cache_hits_and_invalidation():
+    key = CreditReportWriter.generate_key()
+    CreditReportReader.cache = CRFCache()
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "cached.crf")
+            CreditReportWriter.write_file(path, sample_1_records, key)
+            assert CreditReportReader.find_by_sin(path, "676767676", key).credit_score == 800
+            hits = CreditReportReader.cache.hits
+            assert CreditReportReader.find_by_sin(path, "676767676", key).credit_score == 800
+            assert CreditReportReader.cache.hits > hits # header, index bucket and segment all came from the cache
+
+            hits = CreditReportReader.cache.hits
+            CreditReportReader.read_metadata(path, key)
+            CreditReportReader.read_metadata(path, key)
+            assert CreditReportReader.cache.hits == hits + 1
+
+            os.remove(path) # a new file at the same path, which may even get the same inode
+            CreditReportWriter.write_file(path, sample_2_records, key)
+            assert CreditReportReader.find_by_sin(path, "676767676", key) is None
+            assert CreditReportReader.cache.invalidations > 0
+            assert as_tuples(CreditReportReader.read_file(path, key)) == as_tuples(hashed(sample_2_records))
+    finally:
+        CreditReportReader.cache = None
+
+def test_dataset_refresh():
+    key = CreditReportWriter.generate_key()
+    records = generated_records(15)
+    newer = copy.deepcopy(records[5:])
+    for record in newer:
+        record.name += " (newer)"
+    with tempfile.TemporaryDirectory() as directory:
+        dataset = CreditReportDataset(directory, key)
+        dataset.write_shard("a.crf", records[:10])
+        dataset.write_shard("b.crf", newer) # overlaps a.crf on SINs 5-9
+        assert dataset.find_by_sin("000000007").name == "Person 7 (newer)"
+        assert dataset.record_count == 20
+
+        os.remove(os.path.join(directory, "b.crf"))
+        dataset.refresh()
+        assert dataset.find_by_sin("000000007").name == "Person 7" # orphaned, falls back to the older shard
+        assert dataset.find_by_sin("000000012") is None
+        assert [shard.name for shard in dataset.shards] == ["a.crf"] and dataset.record_count == 10
+
+        updated = copy.deepcopy(records[3])
+        updated.credit_score = 850
+        CreditReportDelta.append_file(os.path.join(directory, "a.crf"), [updated], key)
+        try:
+            dataset.find_by_sin("000000003")
+            raise AssertionError("a changed shard was read through stale offsets")
+        except ValueError as e:
+            assert "changed" in str(e)
+        dataset.refresh()
+        assert dataset.find_by_sin("000000003").credit_score == 850
+        assert dataset.find_by_sin("000000004").name == "Person 4" and dataset.record_count == 10
+
+def test_dataset_rekey():
+    key = CreditReportWriter.generate_key()
+    records = generated_records(30)
+    with tempfile.TemporaryDirectory() as directory:
+        dataset = CreditReportDataset(directory, key)
+        dataset.write_shard("a.crf", records[:20])
+        dataset.write_shard("b.crf", records[10:])
+        CreditReportDelta.append_file(os.path.join(directory, "a.crf"), records[:2], key) # compacted by the rotation
+        for rekey in (CreditReportRekeyer.rekey_directory, CreditReportRekeyer.rekey_dataset):
+            new_key = CreditReportWriter.generate_key()
+            assert all(result.error is None for result in rekey(directory, key, new_key, workers=2))
+            rotated = CreditReportDataset(directory, new_key)
+            assert rotated.find_by_sin("000000001").name == "Person 1" and rotated.record_count == 40
+            assert len(rotated.find_by_sins([f"{i:09d}" for i in range(30)])) == 30
+            try:
+                CreditReportDataset(directory, key).find_by_sin("000000001")
+                raise AssertionError("the old key still reads the manifest")
+            except ValueError:
+                pass
+            key = new_key
+
+def test_merge_spills_and_resolves():
+    key = CreditReportWriter.generate_key()
+    inputs = []
+    for number in range(3): # overlapping SIN ranges with different scores
+        records = generated_records(500)[number * 100:number * 100 + 300]
+        for record in records:
+            record.credit_score = (record.credit_score * (number + 7)) % 900
+        inputs.append(records)
+
+    def by_score(older, newer):
+        return newer if newer.credit_score > older.credit_score else older
+
+    spills = []
+    spill = CreditReportMerge._spill
+    CreditReportMerge._spill = staticmethod(lambda *args: spills.append(args[2]) or spill(*args))
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            paths = [os.path.join(directory, f"input_{number}.crf") for number in range(3)]
+            for path, records in zip(paths, inputs):
+                CreditReportWriter.write_file(path, records, key)
+            output = os.path.join(directory, "merged.crf")
+            for resolve, pick in (("last", lambda older, newer: newer), ("first", lambda older, newer: older),
+                                  (by_score, by_score)):
+                expected = {}
+                for records in inputs:
+                    for record in hashed(records):
+                        expected[record.sin] = record if record.sin not in expected else pick(expected[record.sin], record)
+                for memory_limit in (16 * 1024, 2**30): # multi-pass merge of spilled runs, then all in memory
+                    spills.clear()
+                    count = CreditReportMerge.merge_files(paths, output, key, resolve, memory_limit=memory_limit)
+                    assert (len(spills) > MERGE_FAN_IN) == (memory_limit < 2**30)
+                    assert count == len(expected) == 500
+                    assert as_tuples(CreditReportReader.read_file(output, key)) == as_tuples(expected.values())
+            try:
+                CreditReportMerge.merge_files(paths, output, key, "error", memory_limit=16 * 1024)
+                raise AssertionError("duplicates were merged")
+            except ValueError as e:
+                assert "Duplicate" in str(e)
+            assert sorted(os.listdir(directory)) == ["input_0.crf", "input_1.crf", "input_2.crf", "merged.crf"]
+    finally:
+        CreditReportMerge._spill = spill
+
+def test_import_csv_and_jsonl():
+    key = CreditReportWriter.generate_key()
+    records = generated_records(60, names=[f"Account {n}" for n in range(60)]) # new names in every chunk
+    for record in records[::4]:
+        record.address += "\nUnit 2" # quoted over two lines in the CSV
+    with tempfile.TemporaryDirectory() as directory:
+        csv_path = os.path.join(directory, "extract.csv")
+        with open(csv_path, "w", newline="", encoding="utf-8") as f:
+            rows = csv.writer(f)
+            rows.writerow(["sin", "name", "address", "credit_score", "major_flags", "account_count", "accounts"])
+            for record in records:
+                rows.writerow([record.sin, record.name, record.address, record.credit_score, record.major_flags,
+                               record.account_count, ";".join(f"{acc.name}:{acc.balance}" for acc in record.accounts)])
+        jsonl_path = os.path.join(directory, "extract.jsonl")
+        with open(jsonl_path, "w", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps({"sin": record.sin, "name": record.name, "address": record.address,
+                                    "credit_score": record.credit_score, "major_flags": record.major_flags,
+                                    "accounts": [[acc.name, acc.balance] for acc in record.accounts]}) + "\n")
+
+        retries = []
+        append_encoded = CreditReportStreamWriter._append_encoded
+        def spy(writer, *args):
+            added = append_encoded(writer, *args)
+            retries.append(not added)
+            return added
+        CreditReportStreamWriter._append_encoded = spy
+        try:
+            for source in (csv_path, jsonl_path):
+                for workers in (1, 3):
+                    output = os.path.join(directory, "imported.crf")
+                    # 5-line chunks: quoted addresses span chunk boundaries in the CSV
+                    assert CreditReportImporter.import_file(source, output, key, workers=workers, chunk_lines=5,
+                                                            dictionary=True) == 60
+                    assert as_tuples(CreditReportReader.read_file(output, key)) == as_tuples(hashed(records))
+        finally:
+            CreditReportStreamWriter._append_encoded = append_encoded
+        assert any(retries) # a parser's chunk was encoded against a dictionary another chunk had grown since
+
+        bad_csv = os.path.join(directory, "bad.csv")
+        with open(bad_csv, "w", encoding="utf-8") as f:
+            f.write('sin,name,address,credit_score\n1,A,"two\nlines",700\n2,B,b,high\n')
+        bad_jsonl = os.path.join(directory, "bad.jsonl")
+        with open(bad_jsonl, "w", encoding="utf-8") as f:
+            f.write('{"sin": "1", "name": "A", "address": "a", "credit_score": 700}\n\n'
+                    '{"sin": "2", "name": "B", "address": "b", "credit_score": 700, "accounts": [["Loan", 2147483648]]}\n')
+        for source, line in ((bad_csv, 4), (bad_jsonl, 3)):
+            try:
+                CreditReportImporter.import_file(source, os.path.join(directory, "bad.crf"), key, workers=1)
+                raise AssertionError("an invalid row was imported")
+            except ValueError as e:
+                assert f"line {line}:" in str(e)
+        assert not os.path.exists(os.path.join(directory, "bad.crf"))
+
+def test_async_round_trip_and_abort():
+    key = CreditReportWriter.generate_key()
+    records = generated_records(3000)
+
+    async def produce():
+        for record in records:
+            yield record
+
+    async def check(directory):
+        path = os.path.join(directory, "async.crf")
+        await AsyncCreditReportWriter.write_file(path, produce(), key, batch_size=100, segment_size=16 * 1024)
+        assert as_tuples(await AsyncCreditReportReader.read_file(path, key)) == as_tuples(hashed(records))
+        streamed = [record async for record in AsyncCreditReportReader.iter_records(path, key)]
+        assert as_tuples(streamed) == as_tuples(hashed(records))
+        assert (await AsyncCreditReportReader.find_by_sin(path, "000000042", key)).name == "Person 42"
+
+        reader = AsyncCreditReportReader.iter_records(path, key, batch_size=500)
+        async for batch in reader:
+            assert len(batch) == 500
+            break # stops early, the read-ahead is dropped
+        await reader.aclose()
+
+        failed = os.path.join(directory, "failed.crf")
+        try:
+            async with await AsyncCreditReportWriter.open(failed, key, batch_size=100) as writer:
+                await writer.extend(records[:250])
+                raise RuntimeError("export interrupted")
+        except RuntimeError:
+            pass
+        rejected = copy.deepcopy(records[:250])
+        rejected[120].credit_score = -1 # fails on the writer thread, reported by close()
+        try:
+            async with await AsyncCreditReportWriter.open(failed, key, batch_size=100) as writer:
+                await writer.extend(rejected)
+            raise AssertionError("a rejected record was swallowed")
+        except ValueError:
+            pass
+        assert sorted(os.listdir(directory)) == ["async.crf"] # neither output nor temporary file
+
+    with tempfile.TemporaryDirectory() as directory:
+        asyncio.run(check(directory))
+
+def test_shared_memory_with_deltas_and_dictionary():
+    key = CreditReportWriter.generate_key()
+    records = generated_records(500)
+    updated = copy.deepcopy(records[7])
+    updated.accounts.append(Account("Mortgage", -250000)) # a name the base file's dictionary does not hold
+    updated.account_count += 1
+    expected = hashed(records[:7] + [updated] + records[8:])
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "shared.crf")
+        CreditReportWriter.write_file(path, records, key, dictionary=True)
+        CreditReportDelta.append_file(path, [updated], key)
+        with SharedCreditReport.load(path, key) as report:
+            worker = SharedCreditReport.attach(report.name) # what another process does with the name
+            try:
+                assert worker.record_count == 500
+                assert as_tuples(worker.iter_records()) == as_tuples(expected)
+                found = worker.find_by_sin("000000007")
+                assert [(acc.name, acc.balance) for acc in found.accounts][-1] == ("Mortgage", -250000)
+                assert worker.find_by_sin("999999999") is None
+                assert len(worker.find_by_sins(["000000001", "000000499", "999999999"])) == 2
+            finally:
+                worker.close()
+        try:
+            SharedCreditReport.attach(report.name)
+            raise AssertionError("the block outlived unlink()")
+        except FileNotFoundError:
+            pass
+
+def run_checks():
+    for name, check in list(globals().items()):
+        if name.startswith("test_") and callable(check):
+            check()
+            print(f"  ok: {name[5:].replace('_', ' ')}")
 
 if __name__ == "__main__":
+    script_dir = os.path.dirname(os.path.abspath(__file__)) # finds file path of test script
+
+    key_1 = CreditReportWriter.generate_key() # generates encryption keys
+    key_2 = CreditReportWriter.generate_key()
+
+    file_path_1 = os.path.join(script_dir, "sample_1.crf")
+    file_path_2 = os.path.join(script_dir, "sample_2.crf")
+
+    print("Writing CRF files")
+    CreditReportWriter.write_file(file_path_1, sample_1_records, key_1) # calls writer to write into 2 filepaths, 2 different records and 2 different keys
+    CreditReportWriter.write_file(file_path_2, sample_2_records, key_2)
+    print(f"CRF 1 File Created: {file_path_1}")
+    print(f"CRF 2 File Created: {file_path_2}")
+
+    keys_file = os.path.join(script_dir, "encryption_keys.txt") # stores keys in text file, will be stored in secure database, etc.
+    with open(keys_file, "w") as f:
+        f.write(f"sample_1.crf key: {key_1.decode()}\n")
+        f.write(f"sample_2.crf key: {key_2.decode()}\n")
+    print(f"Keys saved to: {keys_file}") # saves decoded keys to encryption_keys.txt file
+
     print("\n" + "="*60)
     print("Reading and displaying sample_1.crf:") # aesthetic printing for visibility
     print("="*60)
@@ -147,6 +633,17 @@ if __name__ == "__main__":
     except Exception as e:
         print(f"Error reading sample_2.crf: {e}")
 
+    print("\n" + "="*60)
+    print("Looking up records by SIN:") # index lookups only decode the matching records
+    print("="*60)
+    try:
+        record = CreditReportReader.find_by_sin(file_path_1, "676767676", key_1)
+        print(f"\n676767676 -> {record.name}, score {record.credit_score}")
+        found = CreditReportReader.find_by_sins(file_path_2, ["111-222-333", "000000000"], key_2)
+        print(f"Batch lookup found {len(found)} of 2: {sorted(found)}")
+    except Exception as e:
+        print(f"Error looking up records: {e}")
+
     print("\n" + "="*60)
     print("Testing encryption security (wrong key):") # key testing
     print("="*60)
@@ -154,4 +651,10 @@ if __name__ == "__main__":
         CreditReportReader.read_file(file_path_1, key_2)  # wrong key
         print("This text shouldn't display")
     except Exception as e:
-        print(f"Incorrect key used: {type(e).__name__}") # should skip to this error message with wrong key
\ No newline at end of file
+        print(f"Incorrect key used: {type(e).__name__}") # should skip to this error message with wrong key
+
+    print("\n" + "="*60)
+    print("Round-trip checks:")
+    print("="*60)
+    run_checks()
+    print("\nAll round-trip checks passed")